@@ -28,6 +28,27 @@ import re
 import sys
 import logging
 import time
+import csv
+import json
+import pickle
+import threading
+import itertools
+import multiprocessing
+import queue
+import gzip
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+
+from bacpypes.apdu import ReadRangeACK
+from bacpypes.core import deferred
+from bacpypes.iocb import IOCB
+from bacpypes.object import get_datatype
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 def show_title():
     """Show the program title and version info
@@ -51,14 +72,14 @@ def show_title():
     print("-" * 60)
 
 # -- Direct Device Discovery Function --
-def find_single_device(bacnet, device_ip):
+def find_single_device(bacnet, device_ip, wait=2):
     """
     Finds a single BACnet device at a known IP address.
     """
     print(f"Sending targeted Who-Is to {device_ip}...")
     bacnet.whois_router_to_network(network=None, destination=device_ip)
     bacnet.whois(device_ip, global_broadcast=True)
-    time.sleep(2)
+    time.sleep(wait)
 
     for name, manufacturer, address, instance_id in bacnet.devices:
         if address.startswith(device_ip):
@@ -92,6 +113,826 @@ def discover_devices(bacnet, subnet_broadcast, interval, checks):
     print("BACnet discovery completed.")
     return bacnet.devices
 
+# -- Streaming Device List Functions --
+DEVICE_STREAM_FIELDS = [
+    "status", "timestamp", "device_name", "sanitized_device_name", "device_vendor",
+    "device_model", "device_firmware", "description", "location",
+    "device_application_version", "device_serial_number", "ip_address", "device_id"
+]
+
+def send_discovery_requests(bacnet, subnet_broadcast, device_ip, global_broadcast, limits, networks):
+    """
+    Sends the Who-Is requests for a scan without waiting for the I-Am answers,
+    which are collected by BAC0 in the background as they arrive.
+    """
+    if subnet_broadcast != "":
+        print(f"Sending Who-Is to {subnet_broadcast}...")
+        bacnet.whois_router_to_network(network=None, destination=subnet_broadcast)
+        bacnet.whois(subnet_broadcast, global_broadcast=True)
+    elif device_ip != "":
+        print(f"Sending targeted Who-Is to {device_ip}...")
+        bacnet.whois_router_to_network(network=None, destination=device_ip)
+        bacnet.whois(device_ip, global_broadcast=True)
+    elif networks:
+        bacnet.discover(global_broadcast=global_broadcast, limits=limits, networks=networks)
+    else:
+        bacnet.discover(global_broadcast=global_broadcast, limits=limits)
+
+def write_device_stream_row(stream, stream_format, row, lock):
+    """
+    Appends one device row to the open stream file and flushes it, so the
+    device list can be followed (e.g. with tail -f) while the scan runs.
+    """
+    with lock:
+        if stream_format == "jsonl":
+            stream.write(json.dumps(row, default=str) + "\n")
+        else:
+            csv.DictWriter(stream, fieldnames=DEVICE_STREAM_FIELDS, extrasaction="ignore").writerow(row)
+        stream.flush()
+
+def stream_device_list(bacnets, discovery, stream_filename, stream_format, verbose, workers, interval, checks, exclude_list, deadline=None):
+    """
+    Streams the device list to a CSV/JSONL file while discovery is running.
+
+    The discovery callable sends the Who-Is requests on one BAC0 instance and runs
+    in a background thread per interface. Devices seen on more than one interface
+    are only listed once.
+    A "discovered" row is appended as soon as each I-Am arrives, then the device
+    properties are read concurrently and a "complete" row with the same device_id
+    is appended when they are available, so the last row per device is the current one.
+    With a deadline, discovery stops and the property reads still running are
+    abandoned when it expires.
+    Returns a list of device info dictionaries, one per device read completely.
+    """
+    lock = threading.Lock()
+    seen = set()
+    futures = []
+    poll_interval = 0.25
+    quiet_time = interval * checks
+    last_new_device = time.time()
+
+    def read_properties(device, bacnet):
+        dev_info = make_device_info_simple(None, verbose, device, network=bacnet)
+        row = dev_info["value"].to_dict()
+        row.update({"status": "complete", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")})
+        write_device_stream_row(stream, stream_format, row, lock)
+        return row
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    with open(stream_filename, "w", newline="") as stream:
+        if stream_format == "csv":
+            csv.DictWriter(stream, fieldnames=DEVICE_STREAM_FIELDS).writeheader()
+        print(f"Streaming device list to {stream_filename}...")
+        threads = [threading.Thread(target=discovery, args=(bacnet,), daemon=True) for bacnet in bacnets.values()]
+        for thread in threads:
+            thread.start()
+
+        while True:
+            # The I-Ams are polled once more after the Who-Is requests have all been sent
+            discovery_sent = not any(thread.is_alive() for thread in threads)
+            for bacnet in bacnets.values():
+                for address, device_id in list(bacnet.this_application.i_am_counter):
+                    if device_id in seen:
+                        continue
+                    seen.add(device_id)
+                    last_new_device = time.time()
+                    if should_exclude_device((address, device_id), exclude_list):
+                        print(f"Excluding device from scan: {(address, device_id)}")
+                        continue
+                    write_device_stream_row(stream, stream_format, {
+                        "status": "discovered",
+                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "ip_address": address,
+                        "device_id": device_id
+                    }, lock)
+                    futures.append(executor.submit(read_properties, (address, device_id), bacnet))
+            if discovery_sent and time.time() - last_new_device >= quiet_time:
+                print(f"No new devices for {quiet_time} seconds, waiting for {len(futures)} property read(s) to complete...")
+                break
+            if deadline is not None and time_left(deadline) <= 0:
+                print("Deadline reached, stopping the discovery.")
+                break
+            time.sleep(poll_interval)
+
+        device_rows = []
+        for future in futures:
+            try:
+                remaining = time_left(deadline)
+                device_rows.append(future.result(timeout=None if remaining is None else max(remaining, 0)))
+            except FutureTimeoutError:
+                print(f"Deadline reached, {sum(not job.done() for job in futures)} property read(s) abandoned.")
+                break
+            except Exception as e:
+                print(f"Error reading device properties: {e}")
+        # The reads abandoned at the deadline are not waited for
+        executor.shutdown(wait=deadline is None or time_left(deadline) > 0, cancel_futures=True)
+
+    print("BACnet streaming discovery completed.")
+    return device_rows
+
+# -- Discovery Dispatch Function --
+def run_discovery(bacnet, subnet_broadcast, device_ip, networks, device_id, device_range, global_scan, interval, checks):
+    """
+    Runs the discovery selected by the command line options on one BAC0 instance
+    and returns the list of discovered devices.
+    """
+    range_start = 0
+    range_finish = 4194302
+    try:
+        if subnet_broadcast != "":
+            discovered_devices = discover_devices(bacnet, subnet_broadcast, interval, checks)
+        elif device_ip != "":
+            discovered_devices = find_single_device(bacnet, device_ip, wait=min(2, interval))
+        elif networks == "":
+            if device_id == "":
+                if device_range != "":
+                    range_start = device_range.split(",")[0]
+                    range_finish = device_range.split(",")[1]
+                    print("start:", range_start)
+                    print("finish:", range_finish)
+                    discover = bacnet.discover(global_broadcast=global_scan, limits=(range_start,range_finish))
+                    discovered_devices = bacnet.devices
+                else:
+                    discover = bacnet.discover(global_broadcast=global_scan)
+                    discovered_devices = bacnet.devices
+            else:
+                discover = bacnet.discover(global_broadcast=global_scan, limits=(device_id,device_id))
+                discovered_devices = bacnet.devices
+        else:
+            bacnet_networks = string_to_integer_list(networks)
+            if device_id == "":
+                if device_range != "":
+                    range_start = device_range.split(",")[0]
+                    range_finish = device_range.split(",")[1]
+                    print("start:", range_start)
+                    print("finish:", range_finish)
+                    discover = bacnet.discover(global_broadcast=global_scan, limits=(range_start,range_finish), networks=bacnet_networks)
+                    discovered_devices = bacnet.devices
+                else:
+                    discover = bacnet.discover(global_broadcast=global_scan, networks=bacnet_networks)
+                    discovered_devices = bacnet.devices
+            else:
+                device_id = int(device_id)
+                discover = bacnet.discover(global_broadcast=global_scan, limits=(device_id,device_id), networks=bacnet_networks)
+                discovered_devices = bacnet.devices
+    except Exception as e:
+        print(f"Discovery phase encountered a critical error: {e}")
+        discovered_devices = getattr(bacnet, 'devices', [])
+    return discovered_devices
+
+# -- Multi-Interface Merge Function --
+def merge_discovered_devices(discovered_by_interface):
+    """
+    Merges the devices discovered on each interface into one list of
+    (device, interface) tuples. A device seen through more than one interface
+    is identified by its BACnet instance and kept only with the first path found.
+    """
+    merged = {}
+    for interface, discovered_devices in discovered_by_interface.items():
+        for device in discovered_devices:
+            device_id = device[-1]
+            if device_id in merged:
+                print(f"Device {device_id} also seen via interface '{interface}' at {device[-2]}, keeping path via '{merged[device_id][1]}'")
+                continue
+            merged[device_id] = (device, interface)
+    return list(merged.values())
+
+# -- Record/Replay Transport --
+RECORDED_CALLS = ["read", "readMultiple", "readRange", "whois", "whois_router_to_network", "discover"]
+
+class ScanRecorder:
+    """
+    Writes the BACnet requests made during a scan, with their responses and
+    timings, to a gzip compressed JSON lines file that can be replayed offline.
+    """
+    def __init__(self, record_filename):
+        self.record_file = gzip.open(record_filename, "wt")
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def write(self, interface, call, args, started, result=None, error=None, snapshot=None):
+        event = {
+            "i": interface,
+            "c": call,
+            "a": args,
+            "t": round(started - self.start, 4),
+            "d": round(time.time() - started, 4)
+        }
+        if error is not None:
+            event["e"] = f"{type(error).__name__}: {error}"
+        elif snapshot is not None:
+            event["p"] = snapshot
+        else:
+            event["r"] = result
+        with self.lock:
+            # Reads abandoned at a deadline can finish after the recording is closed
+            if not self.record_file.closed:
+                self.record_file.write(json.dumps(event, default=str) + "\n")
+
+    def close(self):
+        with self.lock:
+            self.record_file.close()
+
+def device_snapshot(device):
+    """
+    Returns the point properties of a BAC0 device used by make_points, as plain lists.
+    """
+    return [
+        [getattr(each.properties, 'name', 'unknown_point'), getattr(each.properties, 'units_state', ''),
+         getattr(each.properties, 'description', ''), getattr(each.properties, 'type', 'unknown'),
+         getattr(each.properties, 'address', 'unknown'), getattr(each, 'lastValue', '')]
+        for each in getattr(device, 'points', [])
+    ]
+
+def snapshot_device(snapshot):
+    """
+    Builds a stand-in for a BAC0 device, with only its points, from a device_snapshot.
+    """
+    points = [
+        SimpleNamespace(
+            properties=SimpleNamespace(name=name, units_state=units_state, description=description, type=obj_type, address=obj_address),
+            lastValue=last_value
+        )
+        for name, units_state, description, obj_type, obj_address, last_value in snapshot
+    ]
+    return SimpleNamespace(points=points)
+
+class RecordingNetwork:
+    """
+    Stands in front of a BAC0 client and records every request made through it.
+    Anything that is not recorded is forwarded to the real client.
+    """
+    def __init__(self, bacnet, recorder, interface):
+        self.bacnet = bacnet
+        self.recorder = recorder
+        self.interface = interface
+        self.i_ams = []
+
+    def __getattr__(self, name):
+        attribute = getattr(self.bacnet, name)
+        if name not in RECORDED_CALLS:
+            return attribute
+
+        def recorded_call(*args, **kwargs):
+            started = time.time()
+            call_args = [list(args), kwargs]
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception as e:
+                self.recorder.write(self.interface, name, call_args, started, error=e)
+                raise
+            self.recorder.write(self.interface, name, call_args, started, result=result)
+            return result
+        return recorded_call
+
+    @property
+    def devices(self):
+        started = time.time()
+        result = self.bacnet.devices
+        self.recorder.write(self.interface, "devices", [[], {}], started, result=result)
+        return result
+
+    @property
+    def this_application(self):
+        # The I-Ams received so far are recorded whenever they change, as the
+        # streaming scan reads them without going through devices
+        started = time.time()
+        this_application = self.bacnet.this_application
+        i_ams = sorted([str(address), device_id] for address, device_id in list(this_application.i_am_counter))
+        if i_ams != self.i_ams:
+            self.i_ams = i_ams
+            self.recorder.write(self.interface, "i_am_counter", [[], {}], started, result=i_ams)
+        return this_application
+
+    def read_log_buffer(self, *args):
+        started = time.time()
+        call_args = [list(args), {}]
+        try:
+            result = read_log_buffer(self.bacnet, *args)
+        except Exception as e:
+            self.recorder.write(self.interface, "read_log_buffer", call_args, started, error=e)
+            raise
+        self.recorder.write(self.interface, "read_log_buffer", call_args, started, result=result)
+        return result
+
+    def device(self, address, device_id, object_list=None):
+        started = time.time()
+        call_args = [[address, device_id], {}]
+        try:
+            device = open_device(address, device_id, self.bacnet, object_list=object_list)
+        except Exception as e:
+            self.recorder.write(self.interface, "device", call_args, started, error=e)
+            raise
+        self.recorder.write(self.interface, "device", call_args, started, snapshot=device_snapshot(device))
+        return device
+
+class ReplayNetwork:
+    """
+    Local stand-in for a BAC0 client that answers requests from a recorded scan.
+
+    Responses are matched on the request and served in recorded order for repeated
+    requests, the last one being kept for any further identical request, so
+    concurrent scans replay deterministically. With original timing
+    each response is delayed by the time it took on site; requests that were not
+    recorded fail like an unanswered BACnet request.
+    """
+    def __init__(self, events, interface, original_timing):
+        self.interface = interface
+        self.original_timing = original_timing
+        self.responses = {}
+        self.lock = threading.Lock()
+        for event in events:
+            self.responses.setdefault(self.request_key(event["c"], event["a"]), []).append(event)
+        discovered = set()
+        for event in events:
+            if event["c"] == "devices" and "r" in event:
+                discovered.update((device[-2], device[-1]) for device in event["r"])
+            elif event["c"] == "i_am_counter":
+                discovered.update((address, device_id) for address, device_id in event["r"])
+        self.discovered = discovered
+        self.this_application = SimpleNamespace(i_am_counter={})
+
+    @staticmethod
+    def request_key(call, call_args):
+        return json.dumps([call, call_args], default=str)
+
+    def respond(self, call, call_args):
+        with self.lock:
+            queue = self.responses.get(self.request_key(call, call_args), [])
+            event = queue.pop(0) if len(queue) > 1 else (queue[0] if queue else None)
+        if event is None:
+            raise BAC0.core.io.IOExceptions.NoResponseFromController(f"No recorded response for {call} {call_args[0]}")
+        if self.original_timing:
+            time.sleep(event["d"])
+        if "e" in event:
+            raise BAC0.core.io.IOExceptions.NoResponseFromController(f"Recorded error: {event['e']}")
+        if call in ["whois", "discover"]:
+            # Devices answer the Who-Is of a replayed discovery all at once
+            for key in self.discovered:
+                self.this_application.i_am_counter[key] = 1
+        return event
+
+    def __getattr__(self, name):
+        if name not in RECORDED_CALLS:
+            raise AttributeError(f"'{name}' is not available when replaying a recorded scan")
+
+        def replayed_call(*args, **kwargs):
+            return self.respond(name, [list(args), kwargs]).get("r")
+        return replayed_call
+
+    @property
+    def devices(self):
+        return self.respond("devices", [[], {}])["r"]
+
+    def read_log_buffer(self, *args):
+        first_sequence_number, records = self.respond("read_log_buffer", [list(args), {}])["r"]
+        return (first_sequence_number, records)
+
+    def device(self, address, device_id, object_list=None):
+        return snapshot_device(self.respond("device", [[address, device_id], {}])["p"])
+
+def load_replay_networks(replay_filename, original_timing):
+    """
+    Reads a recorded scan and returns a ReplayNetwork for each interface in it.
+    """
+    events_by_interface = {}
+    with gzip.open(replay_filename, "rt") as replay_file:
+        for line in replay_file:
+            event = json.loads(line)
+            events_by_interface.setdefault(event["i"], []).append(event)
+    return {
+        interface: ReplayNetwork(events, interface, original_timing)
+        for interface, events in events_by_interface.items()
+    }
+
+# -- Interface Process Functions --
+INTERFACE_START_TIMEOUT = 60
+# Time in seconds between the checks that the interface process is still running
+INTERFACE_POLL_INTERVAL = 1
+
+def serve_interface(interface, device_instance, workers, log_level, requests, responses):
+    """
+    Runs the BAC0 client of one interface in a process of its own and answers
+    the requests of its InterfaceProcess, up to `workers` at the same time.
+    """
+    BAC0.log_level(log_level)
+    try:
+        if interface != "":
+            bacnet = BAC0.lite(ip=interface, deviceId=device_instance, modelName="bacnet-scan")
+        else:
+            bacnet = BAC0.lite(deviceId=device_instance, modelName="bacnet-scan")
+    except Exception as e:
+        responses.put(pickle.dumps((None, None, RuntimeError(str(e)))))
+        return
+    responses.put(pickle.dumps((None, None, None)))
+
+    def answer(request_id, call, args, kwargs):
+        try:
+            if call == "devices":
+                result = bacnet.devices
+            elif call == "i_am_counter":
+                result = {(str(address), device_id): count for (address, device_id), count in bacnet.this_application.i_am_counter.items()}
+            elif call == "device":
+                result = device_snapshot(BAC0.device(*args, bacnet, poll=0, **kwargs))
+            elif call == "read_log_buffer":
+                result = read_log_buffer(bacnet, *args)
+            else:
+                result = getattr(bacnet, call)(*args, **kwargs)
+            # Pickled here, so a response that cannot be sent fails its request instead of being lost
+            responses.put(pickle.dumps((request_id, result, None)))
+        except Exception as e:
+            # The exception is sent by name, as BACnet errors do not all survive pickling
+            responses.put(pickle.dumps((request_id, None, RuntimeError(f"{type(e).__name__}: {e}"))))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            executor.submit(answer, *request)
+    bacnet.disconnect()
+
+class InterfaceProcess:
+    """
+    Stand-in for the BAC0 client of one interface, running in a child process.
+
+    bacpypes keeps its task manager, deferred functions and socket map per process,
+    so two BAC0 clients in one process would race on them: each interface scanned
+    in parallel gets a process of its own and the scan is merged in the parent.
+    Requests are forwarded to the child and answered as they complete, and fail
+    if the child exits before answering.
+    """
+    def __init__(self, interface, device_instance, workers, log_level):
+        # Forking a process running threads is not safe, the child is spawned
+        context = multiprocessing.get_context("spawn")
+        self.interface = interface
+        self.requests = context.Queue()
+        self.responses = context.Queue()
+        self.pending = {}
+        self.exited = False
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.process = context.Process(target=serve_interface, args=(interface, device_instance, workers, log_level,
+                                                                     self.requests, self.responses), daemon=True)
+        self.process.start()
+        request_id, result, error = pickle.loads(self.responses.get(timeout=INTERFACE_START_TIMEOUT))
+        if error is not None:
+            raise error
+        threading.Thread(target=self.receive, daemon=True).start()
+
+    def receive(self):
+        while True:
+            try:
+                response = self.responses.get(timeout=INTERFACE_POLL_INTERVAL)
+            except queue.Empty:
+                if self.process.is_alive():
+                    continue
+                with self.lock:
+                    self.exited = True
+                    pending, self.pending = self.pending, {}
+                for future in pending.values():
+                    future.set_exception(RuntimeError(f"the process of interface '{self.interface}' exited"))
+                return
+            request_id, result, error = pickle.loads(response)
+            with self.lock:
+                future = self.pending.pop(request_id)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def call(self, call, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            if self.exited:
+                raise RuntimeError(f"the process of interface '{self.interface}' exited")
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+        self.requests.put((request_id, call, args, kwargs))
+        return future.result()
+
+    def __getattr__(self, name):
+        if name not in RECORDED_CALLS:
+            raise AttributeError(f"'{name}' is not available on the BAC0 client of interface '{self.interface}'")
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+
+    @property
+    def devices(self):
+        return self.call("devices")
+
+    @property
+    def this_application(self):
+        return SimpleNamespace(i_am_counter=self.call("i_am_counter"))
+
+    def read_log_buffer(self, *args):
+        return self.call("read_log_buffer", *args)
+
+    def device(self, address, device_id, object_list=None):
+        return snapshot_device(self.call("device", address, device_id, object_list=object_list))
+
+    def disconnect(self):
+        self.requests.put(None)
+        self.process.join(5)
+
+    def terminate(self):
+        """Stops the child at once, without waiting for its pending reads"""
+        self.process.terminate()
+        self.process.join(5)
+
+def open_device(address, device_id, network, object_list=None):
+    """
+    Creates the BAC0 device used to enumerate points, through the recording,
+    replay or interface process transport when one is in use.
+    """
+    if isinstance(network, (RecordingNetwork, ReplayNetwork, InterfaceProcess)):
+        return network.device(address, device_id, object_list=object_list)
+    return BAC0.device(address, device_id, network, poll=0, object_list=object_list)
+
+# -- TrendLog Export Functions --
+TRENDLOG_OBJECT_TYPES = ["trendLog", "trendLogMultiple"]
+TRENDLOG_FIELDS = ["device_id", "object_type", "object_instance", "sequence_number", "timestamp", "datum_index", "datum_type", "value", "status_flags"]
+TRENDLOG_MIN_CHUNK = 1
+TRENDLOG_FIRST_CHUNK = 16
+TRENDLOG_MAX_CHUNK = 256
+
+class TrendLogWriter:
+    """
+    Appends TrendLog records to a CSV or Parquet file as they are read, one chunk
+    at a time, so whole log buffers are never held in memory.
+    """
+    def __init__(self, trends_filename, trends_format):
+        self.trends_format = trends_format
+        self.lock = threading.Lock()
+        self.record_count = 0
+        if trends_format == "parquet":
+            if pa is None:
+                raise ImportError("the parquet format requires the pyarrow package")
+            self.schema = pa.schema([
+                ("device_id", pa.int64()), ("object_type", pa.string()), ("object_instance", pa.int64()),
+                ("sequence_number", pa.int64()), ("timestamp", pa.string()), ("datum_index", pa.int64()),
+                ("datum_type", pa.string()), ("value", pa.string()), ("status_flags", pa.string())
+            ])
+            self.parquet_writer = pq.ParquetWriter(trends_filename, self.schema)
+        else:
+            self.trends_file = open(trends_filename, "w", newline="")
+            self.csv_writer = csv.DictWriter(self.trends_file, fieldnames=TRENDLOG_FIELDS)
+            self.csv_writer.writeheader()
+
+    def write(self, rows):
+        if not rows:
+            return
+        with self.lock:
+            if self.trends_format == "parquet":
+                columns = {field: [row[field] for row in rows] for field in TRENDLOG_FIELDS}
+                self.parquet_writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+            else:
+                self.csv_writer.writerows(rows)
+                self.trends_file.flush()
+            self.record_count += len(rows)
+
+    def close(self):
+        with self.lock:
+            if self.trends_format == "parquet":
+                self.parquet_writer.close()
+            else:
+                self.trends_file.close()
+
+def find_trendlogs(bacnet, address, device_id):
+    """
+    Returns the (object type, instance) of the trendLog and trendLogMultiple
+    objects in the object list of a device.
+    """
+    object_list = bacnet.read(f'{address} device {device_id} objectList')
+    if not isinstance(object_list, list):
+        return []
+    return [(obj_type, obj_instance) for obj_type, obj_instance in object_list if obj_type in TRENDLOG_OBJECT_TYPES]
+
+def bacnet_timestamp_to_string(timestamp):
+    """
+    Converts a BACnet DateTime to an ISO string, ignoring unspecified (255) fields.
+    """
+    year, month, day, day_of_week = timestamp.date
+    hours, minutes, seconds, hundredths = timestamp.time
+    seconds = 0 if seconds == 255 else seconds
+    hundredths = 0 if hundredths == 255 else hundredths
+    return f"{year + 1900:04d}-{month:02d}-{day:02d}T{hours:02d}:{minutes:02d}:{seconds:02d}.{hundredths:02d}"
+
+def read_choice(choice):
+    """
+    Returns the (name, value) of the field that is set in a BACnet choice.
+    """
+    for name, value in choice.__dict__.items():
+        if value is not None:
+            return (name, value)
+    return ("", None)
+
+def plain_log_record(obj_type, record):
+    """
+    Converts a BACnet log record to [timestamp, [[datum type, value], ...], status flags],
+    with one datum per logged property for a trendLogMultiple.
+    """
+    if obj_type == "trendLogMultiple":
+        datum_type, data = read_choice(record.logData)
+        # A trendLogMultiple record holds one value per logged property
+        values = [read_choice(datum) for datum in data] if datum_type == "logData" else [(datum_type, data)]
+        status_flags = ""
+    else:
+        values = [read_choice(record.logDatum)]
+        status_flags = str(record.statusFlags)
+    return [bacnet_timestamp_to_string(record.timestamp), [[value_type, str(value)] for value_type, value in values], status_flags]
+
+def read_log_buffer(bacnet, address, obj_type, obj_instance, sequence_number, count, timeout=10):
+    """
+    Reads up to `count` records of the log buffer of a TrendLog with ReadRange, from
+    `sequence_number` on, and returns (first sequence number, records) as answered by
+    the device, each record as a plain_log_record.
+
+    The device answers from its oldest record when the requested ones have already
+    been overwritten, so the first sequence number of the ReadRange ACK is returned,
+    which BAC0's readRange drops.
+    """
+    if hasattr(bacnet, "read_log_buffer"):
+        # The recording, replay and interface process transports handle the request themselves
+        return bacnet.read_log_buffer(address, obj_type, obj_instance, sequence_number, count)
+    request = bacnet.build_rrange_request(f"{address} {obj_type} {obj_instance} logBuffer".split(),
+                                          range_params=("s", sequence_number, None, None, count))
+    iocb = IOCB(request)
+    iocb.set_timeout(timeout)
+    deferred(bacnet.this_application.request_io, iocb)
+    iocb.wait()
+    if iocb.ioError:
+        raise BAC0.core.io.IOExceptions.NoResponseFromController(f"ReadRange of {obj_type} {obj_instance} failed: {iocb.ioError}")
+    apdu = iocb.ioResponse
+    if not isinstance(apdu, ReadRangeACK):
+        raise BAC0.core.io.IOExceptions.NoResponseFromController(f"ReadRange of {obj_type} {obj_instance} was not acknowledged")
+    records = apdu.itemData.cast_out(get_datatype(apdu.objectIdentifier[0], apdu.propertyIdentifier))
+    return (apdu.firstSequenceNumber, [plain_log_record(obj_type, record) for record in records])
+
+def make_trendlog_rows(device_id, obj_type, obj_instance, first_sequence_number, records):
+    rows = []
+    for offset, (timestamp, values, status_flags) in enumerate(records):
+        row = {
+            "device_id": int(device_id),
+            "object_type": obj_type,
+            "object_instance": int(obj_instance),
+            # Left empty when the device did not give the sequence number of its answer
+            "sequence_number": first_sequence_number + offset if first_sequence_number is not None else None,
+            "timestamp": timestamp
+        }
+        for datum_index, (datum_type, value) in enumerate(values):
+            rows.append(dict(row, datum_index=datum_index, datum_type=datum_type, value=value, status_flags=status_flags))
+    return rows
+
+def export_trendlog(bacnet, address, device_id, obj_type, obj_instance, writer):
+    """
+    Reads the log buffer of one TrendLog object with ReadRange by sequence number.
+
+    The chunk size starts at TRENDLOG_FIRST_CHUNK records, doubles after each
+    successful read up to TRENDLOG_MAX_CHUNK and halves when a read fails (e.g. on
+    devices that do not support segmentation), which also lowers the maximum for
+    that object. Each chunk is written as soon as it arrives, numbered from the
+    first sequence number answered by the device, which moves past the requested
+    one when a circular buffer overwrote records during the export.
+    Returns the number of records exported.
+    """
+    total_record_count, record_count = bacnet.readMultiple(
+        f"{address} {obj_type} {obj_instance} totalRecordCount recordCount"
+    )
+    # Sequence numbers of the records still in the buffer end at totalRecordCount
+    sequence_number = max(int(total_record_count) - int(record_count) + 1, 1)
+    chunk = TRENDLOG_FIRST_CHUNK
+    chunk_limit = TRENDLOG_MAX_CHUNK
+    exported = 0
+
+    while sequence_number <= int(total_record_count):
+        try:
+            first_sequence_number, records = read_log_buffer(bacnet, address, obj_type, obj_instance, sequence_number, chunk)
+        except Exception as e:
+            if chunk == TRENDLOG_MIN_CHUNK:
+                print(f"  - Could not read log buffer of {obj_type} {obj_instance} on device {device_id} at record {sequence_number}: {e}")
+                break
+            chunk = max(chunk // 2, TRENDLOG_MIN_CHUNK)
+            chunk_limit = chunk
+            continue
+        if not records:
+            break
+        if first_sequence_number is not None and first_sequence_number > sequence_number:
+            # The buffer wrapped around while it was being exported
+            print(f"  - {first_sequence_number - sequence_number} record(s) of {obj_type} {obj_instance} on device {device_id} were overwritten before they could be read")
+        writer.write(make_trendlog_rows(device_id, obj_type, obj_instance, first_sequence_number, records))
+        sequence_number = (first_sequence_number if first_sequence_number is not None else sequence_number) + len(records)
+        exported += len(records)
+        chunk = min(chunk * 2, chunk_limit)
+    return exported
+
+def export_device_trendlogs(bacnet, device, writer):
+    """
+    Exports every TrendLog of a device and returns the number of records exported.
+    """
+    address, device_id = device[-2], device[-1]
+    trendlogs = find_trendlogs(bacnet, address, device_id)
+    exported = 0
+    for obj_type, obj_instance in trendlogs:
+        exported += export_trendlog(bacnet, address, device_id, obj_type, obj_instance, writer)
+    print(f"Exported {exported} trend record(s) from {len(trendlogs)} TrendLog object(s) of device {device_id}")
+    return exported
+
+# -- Deadline Functions --
+def time_left(deadline):
+    """
+    Returns the seconds left before the scan deadline, or None without a deadline.
+    The deadline is a (start time, time budget in seconds) tuple.
+    """
+    if deadline is None:
+        return None
+    return deadline[0] + deadline[1] - time.time()
+
+def exit_at_deadline(interface_processes):
+    """
+    Exits once the output is written at the deadline. The abandoned reads may still
+    be waiting for BACnet timeouts, so the process leaves without waiting for them,
+    stopping the interface processes first: os._exit skips the multiprocessing
+    cleanup and they would keep their BACnet port.
+    """
+    print("Deadline reached, output written, exiting without waiting for the pending reads.")
+    sys.stdout.flush()
+    for interface_process in interface_processes:
+        interface_process.terminate()
+    os._exit(0)
+
+def deadline_is_close(deadline):
+    """
+    True in the last quarter of the deadline time budget, when low priority
+    properties are skipped.
+    """
+    return deadline is not None and time_left(deadline) < deadline[1] / 4
+
+def deadline_concurrency(workers, deadline):
+    """
+    Returns how many devices to read at the same time: the configured number of
+    workers, doubled once half of the deadline time budget is used and
+    quadrupled in its last quarter.
+    """
+    if deadline is None:
+        return workers
+    fraction_left = time_left(deadline) / deadline[1]
+    if fraction_left < 0.25:
+        return workers * 4
+    if fraction_left < 0.5:
+        return workers * 2
+    return workers
+
+def run_with_deadline(tasks, workers, deadline):
+    """
+    Runs a list of (key, callable) tasks on a thread pool, adjusting the number of
+    tasks in flight with deadline_concurrency. Once the deadline has passed no more
+    tasks are started and the ones still running are abandoned.
+    Returns (results, unfinished): results maps each finished key to the value
+    returned by its callable (or the exception raised), unfinished lists the other keys.
+    """
+    results = {}
+    pending = list(tasks)
+    running = {}
+    executor = ThreadPoolExecutor(max_workers=workers * 4)
+    try:
+        while pending or running:
+            remaining = time_left(deadline)
+            if remaining is not None and remaining <= 0:
+                break
+            while pending and len(running) < deadline_concurrency(workers, deadline):
+                key, task = pending.pop(0)
+                running[executor.submit(task)] = key
+            done, _ = wait(list(running), timeout=None if remaining is None else min(remaining, 1), return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = e
+    finally:
+        executor.shutdown(wait=not running and not pending, cancel_futures=True)
+    unfinished = list(running.values()) + [key for key, task in pending]
+    return results, unfinished
+
+def make_coverage_report(discovered_devices, coverage):
+    """
+    Builds the scan_coverage sheet, listing what was collected for each discovered device.
+    """
+    rows = []
+    for device, interface in discovered_devices:
+        device_coverage = coverage.get(device[-1], {})
+        rows.append({
+            "device_id": device[-1],
+            "ip_address": device[-2],
+            "interface": interface,
+            "device_info": device_coverage.get("device_info", "not read"),
+            "points": device_coverage.get("points", "not read"),
+            "point_count": device_coverage.get("point_count", 0)
+        })
+    coverage_df = pd.DataFrame(rows, columns=["device_id", "ip_address", "interface", "device_info", "points", "point_count"])
+    coverage_df.index.name = "number"
+    return coverage_df
+
 # -- Point Enumeration Function --
 def enumerate_device_points(bacnet, discovered_devices):
     """
@@ -148,38 +989,67 @@ def enumerate_device_points(bacnet, discovered_devices):
     return pd.DataFrame(all_devices_data), objects_by_device
 
 
-def create_data(output_path, verbose, discovered_devices, network, devicesonly):
-    devices = {}
-    points = {}
-    for each in discovered_devices:
-        try:
-            name, vendor, address, device_id = each
-        except ValueError:
-            address, device_id = each[0], each[1]
-            name = f"Unknown_Device_{device_id}"
-            vendor = "Unknown"
+def create_device_data(output_path, verbose, each, network, devicesonly):
+    try:
+        name, vendor, address, device_id = each
+    except ValueError:
+        address, device_id = each[0], each[1]
+        name = f"Unknown_Device_{device_id}"
+        vendor = "Unknown"
+
+    custom_obj_list = None
+    sanitized_dev_name = sanitize_device_name(name)
 
-        custom_obj_list = None
-        sanitized_dev_name = sanitize_device_name(name)
+    device = open_device(address, device_id, network, object_list=custom_obj_list)
 
+    combined_id_name = f"{device_id}_{sanitized_dev_name}"
+    device_points = None
+    if not devicesonly:
         try:
-            devices[sanitized_dev_name] = BAC0.device(
-                address, device_id, network, poll=0, object_list=custom_obj_list
-            )
+            device_points = make_points(output_path, verbose, device, combined_id_name, sanitized_dev_name)
         except Exception as e:
-            print(f"Skipping device {sanitized_dev_name} at {address} due to creation error: {e}")
+            print(f"Skipping points for device {sanitized_dev_name} due to enumeration error: {e}")
+    return (sanitized_dev_name, device, combined_id_name, device_points)
+
+def create_data(output_path, verbose, discovered_devices, network, devicesonly, workers=1, deadline=None, coverage=None):
+    """
+    Creates a BAC0 device for each discovered device and enumerates its points,
+    reading up to `workers` devices at the same time. With a deadline, devices
+    that have not been read when it passes are left out and marked in `coverage`.
+    """
+    devices = {}
+    points = {}
+    coverage = coverage if coverage is not None else {}
+    tasks = [
+        (each[-1], lambda each=each: create_device_data(output_path, verbose, each, network, devicesonly))
+        for each in discovered_devices
+    ]
+    results, unfinished = run_with_deadline(tasks, workers, deadline)
+
+    for each in discovered_devices:
+        device_id = each[-1]
+        if device_id not in results:
+            continue
+        result = results[device_id]
+        if isinstance(result, Exception):
+            print(f"Skipping device {device_id} due to creation error: {result}")
+            coverage.setdefault(device_id, {})["points"] = "error"
             continue
+        sanitized_dev_name, device, combined_id_name, device_points = result
+        devices[sanitized_dev_name] = device
+        if device_points is not None:
+            points[combined_id_name] = device_points
+            coverage.setdefault(device_id, {})["points"] = "complete"
+            coverage[device_id]["point_count"] = len(device_points)
+        else:
+            coverage.setdefault(device_id, {})["points"] = "error"
+
+    for device_id in unfinished:
+        coverage.setdefault(device_id, {})["points"] = "skipped (deadline)"
 
-        if not devicesonly:
-            try:
-                combined_id_name = f"{device_id}_{sanitized_dev_name}"
-                points[combined_id_name] = make_points(output_path, verbose, devices[sanitized_dev_name], combined_id_name, sanitized_dev_name)
-            except Exception as e:
-                print(f"Skipping points for device {sanitized_dev_name} due to enumeration error: {e}")
-                
     return (devices,points)
 
-def make_device_info_simple(output_path, verbose, dev, network):
+def make_device_info_simple(output_path, verbose, dev, network, essential_only=False):
     lst = {}
     
     try:
@@ -197,13 +1067,20 @@ def make_device_info_simple(output_path, verbose, dev, network):
     application_software_version = ""
 
     try:
-        results = network.readMultiple(
-            f"{address} device {device_id} objectName vendorName"
-            " firmwareRevision modelName serialNumber description location applicationSoftwareVersion"
-        )
-        
-        if results and len(results) == 8:
-            object_name, vendor_name, firmware_version, model_name, serial_number, description, location, application_software_version = results
+        if essential_only:
+            # Low priority properties are skipped when the scan deadline is close
+            results = network.readMultiple(f"{address} device {device_id} objectName vendorName modelName")
+
+            if results and len(results) == 3:
+                object_name, vendor_name, model_name = results
+        else:
+            results = network.readMultiple(
+                f"{address} device {device_id} objectName vendorName"
+                " firmwareRevision modelName serialNumber description location applicationSoftwareVersion"
+            )
+
+            if results and len(results) == 8:
+                object_name, vendor_name, firmware_version, model_name, serial_number, description, location, application_software_version = results
             
     except (BAC0.core.io.IOExceptions.SegmentationNotSupported, Exception) as err:
         print(f"Warning: error reading standard properties from {address}/{device_id}. Using fallbacks. ({err})")
@@ -359,13 +1236,17 @@ def sanitize_excel_sheet_name(input_string):
     s = s[:31]
     return s
 
-def make_sheet(devices_df, dfs, sheet_filename):
+def make_sheet(devices_df, dfs, sheet_filename, coverage_df=None):
     print("Compiling final Excel spreadsheet...")
     try:
         with pd.ExcelWriter(sheet_filename, engine='xlsxwriter') as writer:
             # 1. Sanitize the main "devices" tab too
             devices_df.to_excel(writer, sheet_name="devices_list")
             used_sheet_names = {"devices_list"}
+
+            if coverage_df is not None:
+                coverage_df.to_excel(writer, sheet_name="scan_coverage")
+                used_sheet_names.add("scan_coverage")
             
             for k, v in dfs.items():
                 # 2. Force conversion to string and sanitize
@@ -456,7 +1337,7 @@ def main():
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-v", "--verbose", action="store_true", default=False, help="increase the verbosity level (optional)")
     parser.add_argument("-x", "--export",  default="bacnet-scan.xlsx", help="spreadsheet file name for scan results")
-    parser.add_argument("-a", "--address", default="", help="IP address of BACnet interface in Mango (optional)")
+    parser.add_argument("-a", "--address", default="", help="IP address of BACnet interface in Mango, or a comma separated list of addresses to scan several interfaces in parallel (optional)")
     parser.add_argument("-n", "--networks", default="", help="comma separated target list of BACnet networks (optional)")
     parser.add_argument("-b", "--bacnetid", default="", help="restrict the scan to only one device with this BACnet ID")
     parser.add_argument("-r", "--range", default="",  help="restrict the scan to a device range")
@@ -465,6 +1346,15 @@ def main():
     parser.add_argument("-s", "--subnet_broadcast", default="", help="restrict the scan to a specific subnet broadcast address")
     parser.add_argument("-i", "--ip", default="", help="restrict the scan to a specific device with this IP address")
     parser.add_argument("-e", "--exclude", default="", help="comma separated list of BACnet device IDs to exclude from scan (optional)")
+    parser.add_argument("--stream", action="store_true", default=False, help="with --deviceonly, write each device to the device list as soon as its I-Am arrives (optional)")
+    parser.add_argument("--stream-format", default="csv", choices=["csv", "jsonl"], help="file format of the streamed device list (optional, the default is csv)")
+    parser.add_argument("--deadline", default="", help="time budget in seconds for the whole scan: concurrency is increased and low priority properties are skipped as time runs short, and whatever was collected is written when it expires (optional)")
+    parser.add_argument("--trends", action="store_true", default=False, help="export the TrendLog buffers of the discovered devices instead of their point lists (optional)")
+    parser.add_argument("--trends-format", default="csv", choices=["csv", "parquet"], help="file format of the TrendLog export (optional, the default is csv, parquet requires pyarrow)")
+    parser.add_argument("--record", default="", help="record the BACnet requests and responses of this scan to a .jsonl.gz file (optional)")
+    parser.add_argument("--replay", default="", help="replay a scan recorded with --record instead of using the BACnet network (optional)")
+    parser.add_argument("--replay-timing", default="original", choices=["original", "fast"], help="replay responses with their original timing or as fast as possible (optional, the default is original)")
+    parser.add_argument("-w", "--workers", default="", help="number of devices read concurrently (optional, the default is 8 for --stream and --trends, and for the device properties and points 1 without --deadline and 8 with it)")
 
     args = parser.parse_args()
 
@@ -477,7 +1367,7 @@ def main():
         pass
 
 
-    BACNET_IP_ADDRESS = args.address
+    BACNET_IP_ADDRESSES = [x.strip() for x in args.address.split(",") if x.strip()] or [""]
     SHEET_FILENAME = args.export
     SHEET_FILENAME_NAME, SHEET_FILENAME_EXT = os.path.splitext(SHEET_FILENAME)
     BACNET_NETWORKS = args.networks
@@ -487,6 +1377,13 @@ def main():
     DEVICE_ONLY_SCAN = args.deviceonly
     TARGET_SUBNET_BROADCAST = args.subnet_broadcast 
     TARGET_IP_ADDRESS = args.ip
+    STREAM_DEVICE_LIST = args.stream
+    TRENDS_EXPORT = args.trends
+    WORKERS = max(1, int(args.workers or 8))
+    # The deadline is kept as (start time, time budget in seconds)
+    deadline = (time.time(), float(args.deadline)) if args.deadline != "" else None
+    # An ordinary scan reads the device properties and points one device at a time
+    SCAN_WORKERS = WORKERS if args.workers != "" or deadline is not None else 1
     
     BACNET_RANGE_START = 0
     BACNET_RANGE_FINISH = 4194302
@@ -496,91 +1393,131 @@ def main():
     print(("Bacnet Global Scan:", BACNET_GLOBAL_SCAN))
     print("Initializing BAC0 client...")
     
-    try:
-        if BACNET_IP_ADDRESS != "":        
-            bacnet = BAC0.lite(ip=BACNET_IP_ADDRESS, deviceId=4194301, modelName="bacnet-scan")
-        else:
-            bacnet = BAC0.lite(deviceId=4194301, modelName="bacnet-scan")
-    except Exception as e:
-        print(f"Failed to initialize BAC0 client: {e}")
+    # One BAC0 instance per interface, each with its own local device instance
+    bacnets = {}
+    interface_processes = []
+    recorder = None
+    if args.replay != "":
+        print(f"Replaying recorded scan {args.replay} ({args.replay_timing} timing)...")
+        bacnets = load_replay_networks(args.replay, args.replay_timing == "original")
+        if args.replay_timing == "fast":
+            # The replayed devices answer at once, there is nothing to wait for
+            POLLING_INTERVAL = 0
+    else:
+        for index, interface in enumerate(BACNET_IP_ADDRESSES):
+            try:
+                if len(BACNET_IP_ADDRESSES) > 1:
+                    # bacpypes does not support two clients in one process, each interface is scanned from its own
+                    bacnets[interface] = InterfaceProcess(interface, 4194301 - index, WORKERS * 4, "info" if args.verbose else "silence")
+                elif interface != "":
+                    bacnets[interface] = BAC0.lite(ip=interface, deviceId=4194301 - index, modelName="bacnet-scan")
+                else:
+                    bacnets[interface] = BAC0.lite(deviceId=4194301 - index, modelName="bacnet-scan")
+            except Exception as e:
+                print(f"Failed to initialize BAC0 client on interface '{interface}': {e}")
+
+        interface_processes = [bacnet for bacnet in bacnets.values() if isinstance(bacnet, InterfaceProcess)]
+
+        if args.record != "":
+            print(f"Recording BACnet traffic to {args.record}...")
+            recorder = ScanRecorder(args.record)
+            bacnets = {interface: RecordingNetwork(bacnet, recorder, interface) for interface, bacnet in bacnets.items()}
+
+    if not bacnets:
         sys.exit(1)
 
-    # Step 1: Discover Devices
-    try:
-        if TARGET_SUBNET_BROADCAST != "":
-            discovered_devices = discover_devices(bacnet, TARGET_SUBNET_BROADCAST, POLLING_INTERVAL, STABILITY_CHECKS)        
-        elif TARGET_IP_ADDRESS != "":
-            discovered_devices = find_single_device(bacnet, TARGET_IP_ADDRESS)
-        elif BACNET_NETWORKS == "":
-            if BACNET_DEVICE_ID == "":
-                if BACNET_RANGE != "":
-                    BACNET_RANGE_START = BACNET_RANGE.split(",")[0]
-                    BACNET_RANGE_FINISH = BACNET_RANGE.split(",")[1]
-                    print("start:", BACNET_RANGE_START)
-                    print("finish:", BACNET_RANGE_FINISH)
-                    discover = bacnet.discover(global_broadcast=BACNET_GLOBAL_SCAN, limits=(BACNET_RANGE_START,BACNET_RANGE_FINISH))
-                    discovered_devices = bacnet.devices
-                else:
-                    discover = bacnet.discover(global_broadcast=BACNET_GLOBAL_SCAN) 
-                    discovered_devices = bacnet.devices
-            else:
-                discover = bacnet.discover(global_broadcast=BACNET_GLOBAL_SCAN, limits=(BACNET_DEVICE_ID,BACNET_DEVICE_ID))
-                discovered_devices = bacnet.devices
+    exclude_list = [x.strip() for x in args.exclude.split(',')] if args.exclude else []
+    output_path = "bacnet_devices"
+
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    # Streaming device-only scan: rows are written while discovery is still running
+    if DEVICE_ONLY_SCAN and STREAM_DEVICE_LIST:
+        if BACNET_DEVICE_ID != "":
+            limits = (int(BACNET_DEVICE_ID), int(BACNET_DEVICE_ID))
+        elif BACNET_RANGE != "":
+            limits = (int(BACNET_RANGE.split(",")[0]), int(BACNET_RANGE.split(",")[1]))
         else:
-            bacnet_networks = string_to_integer_list(BACNET_NETWORKS)
-            if BACNET_DEVICE_ID == "":
-                if BACNET_RANGE != "":
-                    BACNET_RANGE_START = BACNET_RANGE.split(",")[0]
-                    BACNET_RANGE_FINISH = BACNET_RANGE.split(",")[1]
-                    print("start:", BACNET_RANGE_START)
-                    print("finish:", BACNET_RANGE_FINISH)
-                    discover = bacnet.discover(global_broadcast=BACNET_GLOBAL_SCAN, limits=(BACNET_RANGE_START,BACNET_RANGE_FINISH), networks=bacnet_networks)
-                    discovered_devices = bacnet.devices
-                else:
-                    discover = bacnet.discover(global_broadcast=BACNET_GLOBAL_SCAN, networks=bacnet_networks) 
-                    discovered_devices = bacnet.devices
-            elif BACNET_DEVICE_ID != "":
-                BACNET_DEVICE_ID = int(BACNET_DEVICE_ID)
-                discover = bacnet.discover(global_broadcast=BACNET_GLOBAL_SCAN, limits=(BACNET_DEVICE_ID,BACNET_DEVICE_ID), networks=bacnet_networks)
-                discovered_devices = bacnet.devices
-    except Exception as e:
-        print(f"Discovery phase encountered a critical error: {e}")
-        discovered_devices = getattr(bacnet, 'devices', [])
+            limits = (BACNET_RANGE_START, BACNET_RANGE_FINISH)
+        bacnet_networks = string_to_integer_list(BACNET_NETWORKS)
+        discovery = lambda bacnet: send_discovery_requests(bacnet, TARGET_SUBNET_BROADCAST, TARGET_IP_ADDRESS, BACNET_GLOBAL_SCAN, limits, bacnet_networks)
+        stream_filename = os.path.join(output_path, "%s_devicelist_stream.%s" % (SHEET_FILENAME_NAME, args.stream_format))
+        device_rows = stream_device_list(bacnets, discovery, stream_filename, args.stream_format, args.verbose, WORKERS, POLLING_INTERVAL, STABILITY_CHECKS, exclude_list, deadline)
+        if device_rows:
+            devices_df = pd.DataFrame(device_rows).drop(columns=["status", "timestamp"])
+            devices_df.index.name = "number"
+            print(tabulate(devices_df, headers='keys', tablefmt='psql'))
+            devices_df.to_csv(os.path.join(output_path, "%s_devicelist.csv" % SHEET_FILENAME_NAME))
+        if recorder is not None:
+            recorder.close()
+        if deadline is not None and time_left(deadline) <= 0:
+            exit_at_deadline(interface_processes)
+        return
+
+    # Step 1: Discover Devices, in parallel on every interface
+    executor = ThreadPoolExecutor(max_workers=len(bacnets))
+    discovery_jobs = {
+        interface: executor.submit(run_discovery, bacnet, TARGET_SUBNET_BROADCAST, TARGET_IP_ADDRESS, BACNET_NETWORKS,
+                                   BACNET_DEVICE_ID, BACNET_RANGE, BACNET_GLOBAL_SCAN, POLLING_INTERVAL, STABILITY_CHECKS)
+        for interface, bacnet in bacnets.items()
+    }
+    discovered_by_interface = {}
+    for interface, job in discovery_jobs.items():
+        try:
+            remaining = time_left(deadline)
+            discovered_by_interface[interface] = job.result(timeout=None if remaining is None else max(remaining, 0))
+        except FutureTimeoutError:
+            # Keep the devices that answered so far, names are read later if time allows
+            print(f"Deadline reached during discovery on interface '{interface}', keeping the devices found so far.")
+            discovered_by_interface[interface] = [
+                (f"Unknown_Device_{device_id}", "Unknown", address, device_id)
+                for address, device_id in list(bacnets[interface].this_application.i_am_counter)
+            ]
+    executor.shutdown(wait=False)
+    discovered_devices = merge_discovered_devices(discovered_by_interface)
 
-    exclude_list = [x.strip() for x in args.exclude.split(',')] if args.exclude else []
     if exclude_list:
         filtered_devices = []
-        for dev in discovered_devices:
+        for dev, interface in discovered_devices:
             if should_exclude_device(dev, exclude_list):
                 print(f"Excluding device from scan: {dev}")
                 continue
-            filtered_devices.append(dev)
+            filtered_devices.append((dev, interface))
         discovered_devices = filtered_devices
 
-    output_path = "bacnet_devices"
-
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-        
     devices_df = pd.DataFrame()
+    coverage = {}
     
     try:
-        bacnet_devices_df = pd.DataFrame(discovered_devices, columns=['device_name', 'manufacturer', 'address', 'device_id'])
+        bacnet_devices_df = pd.DataFrame([tuple(dev) + (interface,) for dev, interface in discovered_devices],
+                                         columns=['device_name', 'manufacturer', 'address', 'device_id', 'interface'])
         bacnet_devices_df.index.name = "number"
         bacnet_devices_df.to_csv(os.path.join(output_path, "%s_devicelist_simple.csv" % SHEET_FILENAME_NAME))
     except Exception as e:
         print(f"Could not save simple device list: {e}")
 
-    for device in discovered_devices:
-        try:
-            address = device[0]
-            device_id = device[1]
-            dev_info = make_device_info_simple(output_path, args.verbose, device, network=bacnet)
-            if not dev_info.empty:
-                devices_df = pd.concat([devices_df, dev_info], ignore_index=True, axis=1)
-        except Exception as e:
-            print(f"Error processing preliminary info for device {device}: {e}")
+    def read_device_info(device, interface):
+        essential_only = deadline_is_close(deadline)
+        dev_info = make_device_info_simple(output_path, args.verbose, device, network=bacnets[interface], essential_only=essential_only)
+        coverage.setdefault(device[-1], {})["device_info"] = "reduced (deadline)" if essential_only else "complete"
+        return dev_info
+
+    device_info_results, unfinished = run_with_deadline(
+        [(device[-1], lambda device=device, interface=interface: read_device_info(device, interface))
+         for device, interface in discovered_devices],
+        SCAN_WORKERS, deadline)
+    for device_id in unfinished:
+        coverage.setdefault(device_id, {})["device_info"] = "skipped (deadline)"
+
+    for device, interface in discovered_devices:
+        dev_info = device_info_results.get(device[-1])
+        if isinstance(dev_info, Exception):
+            print(f"Error processing preliminary info for device {device}: {dev_info}")
+            coverage.setdefault(device[-1], {})["device_info"] = "error"
             continue
+        if dev_info is not None and not dev_info.empty:
+            devices_df = pd.concat([devices_df, dev_info], ignore_index=True, axis=1)
         
     if not devices_df.empty:
         devices_df = devices_df.transpose()
@@ -588,11 +1525,52 @@ def main():
         print(tabulate(devices_df, headers='keys', tablefmt='psql'))
         devices_df.to_csv(os.path.join(output_path, "%s_devicelist.csv" % SHEET_FILENAME_NAME))
     
-    if not DEVICE_ONLY_SCAN:
-        devices, points = create_data(output_path, args.verbose, discovered_devices, network=bacnet, devicesonly=DEVICE_ONLY_SCAN)
-        make_sheet(devices_df, points, os.path.join(output_path, SHEET_FILENAME))
+    if TRENDS_EXPORT:
+        trends_filename = os.path.join(output_path, "%s_trends.%s" % (SHEET_FILENAME_NAME, args.trends_format))
+        writer = TrendLogWriter(trends_filename, args.trends_format)
+        print(f"Exporting TrendLog buffers to {trends_filename}...")
+        trend_results, unfinished = run_with_deadline(
+            [(device[-1], lambda device=device, interface=interface: export_device_trendlogs(bacnets[interface], device, writer))
+             for device, interface in discovered_devices],
+            WORKERS, deadline)
+        for device_id, result in trend_results.items():
+            if isinstance(result, Exception):
+                print(f"Could not export TrendLogs of device {device_id}: {result}")
+        writer.close()
+        print(f"{writer.record_count} trend record(s) written to {trends_filename}")
+    elif not DEVICE_ONLY_SCAN:
+        points = {}
+        with ThreadPoolExecutor(max_workers=len(bacnets)) as executor:
+            point_jobs = [
+                executor.submit(create_data, output_path, args.verbose,
+                                [dev for dev, dev_interface in discovered_devices if dev_interface == interface],
+                                network=bacnet, devicesonly=DEVICE_ONLY_SCAN,
+                                workers=SCAN_WORKERS, deadline=deadline, coverage=coverage)
+                for interface, bacnet in bacnets.items()
+            ]
+            for job in point_jobs:
+                devices, interface_points = job.result()
+                points.update(interface_points)
+
+    coverage_df = make_coverage_report(discovered_devices, coverage) if deadline is not None else None
+
+    if recorder is not None:
+        recorder.close()
+        print(f"BACnet traffic recorded to {args.record}")
+
+    if not DEVICE_ONLY_SCAN and not TRENDS_EXPORT:
+        make_sheet(devices_df, points, os.path.join(output_path, SHEET_FILENAME), coverage_df=coverage_df)
+
+    if coverage_df is not None:
+        coverage_df.to_csv(os.path.join(output_path, "%s_coverage.csv" % SHEET_FILENAME_NAME))
+        complete = (coverage_df["points"] == "complete").sum() if not (DEVICE_ONLY_SCAN or TRENDS_EXPORT) else (coverage_df["device_info"] == "complete").sum()
+        print(f"Scan coverage: {complete}/{len(coverage_df)} device(s) complete, {max(time_left(deadline), 0):.0f} second(s) left before the deadline.")
+        if time_left(deadline) <= 0:
+            exit_at_deadline(interface_processes)
 
 if __name__ == "__main__":
+    # Needed by the interface processes in the PyInstaller executables
+    multiprocessing.freeze_support()
     try:
         main()
     except KeyboardInterrupt:
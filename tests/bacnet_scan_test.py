@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import unittest
+import importlib.util
+import os
+import threading
+import time
+import subprocess
+import tempfile
+import shutil
+from types import SimpleNamespace
+import pandas as pd
+
+# --- Configuration ---
+MAIN_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bacnet-scan.py'))
+REPLAY_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), 'bacnet_scan_test_replay.jsonl.gz'))
+STREAM_REPLAY_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), 'bacnet_scan_test_stream.jsonl.gz'))
+
+def load_script():
+    """Imports bacnet-scan.py, whose name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location("bacnet_scan", MAIN_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+bacnet_scan = load_script()
+
+class TestMergeDiscoveredDevices(unittest.TestCase):
+
+    def test_device_seen_on_two_interfaces_is_kept_once(self):
+        merged = bacnet_scan.merge_discovered_devices({
+            "192.168.1.100/24": [("AHU-1", "Vendor", "192.168.1.20", 1001), ("AHU-2", "Vendor", "192.168.1.21", 1002)],
+            "10.10.0.5/24": [("AHU-1", "Vendor", "10.10.0.20", 1001), ("VAV-1", "Vendor", "10.10.0.30", 2001)]
+        })
+        self.assertEqual(merged, [
+            (("AHU-1", "Vendor", "192.168.1.20", 1001), "192.168.1.100/24"),
+            (("AHU-2", "Vendor", "192.168.1.21", 1002), "192.168.1.100/24"),
+            (("VAV-1", "Vendor", "10.10.0.30", 2001), "10.10.0.5/24")
+        ])
+
+    def test_no_devices(self):
+        self.assertEqual(bacnet_scan.merge_discovered_devices({"": []}), [])
+
+class TestRunWithDeadline(unittest.TestCase):
+
+    def test_without_deadline_every_task_runs(self):
+        def fail():
+            raise ValueError("no response")
+        results, unfinished = bacnet_scan.run_with_deadline([(1, lambda: "a"), (2, fail), (3, lambda: "c")], 2, None)
+        self.assertEqual(results[1], "a")
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual(results[3], "c")
+        self.assertEqual(unfinished, [])
+
+    def test_one_worker_runs_tasks_one_at_a_time(self):
+        lock = threading.Lock()
+        running = [0]
+        most_running = [0]
+        def task():
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+        results, unfinished = bacnet_scan.run_with_deadline([(n, task) for n in range(5)], 1, None)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(most_running[0], 1)
+
+    def test_expired_deadline_starts_nothing(self):
+        deadline = (time.time() - 10, 5)
+        results, unfinished = bacnet_scan.run_with_deadline([(1, lambda: "a"), (2, lambda: "b")], 1, deadline)
+        self.assertEqual(results, {})
+        self.assertEqual(sorted(unfinished), [1, 2])
+
+    def test_slow_task_is_abandoned_at_the_deadline(self):
+        release = threading.Event()
+        deadline = (time.time(), 0.5)
+        start = time.time()
+        results, unfinished = bacnet_scan.run_with_deadline([(1, lambda: release.wait(5)), (2, lambda: "b")], 2, deadline)
+        release.set()
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(results, {2: "b"})
+        self.assertEqual(unfinished, [1])
+
+    def test_concurrency_grows_as_the_deadline_approaches(self):
+        now = time.time()
+        self.assertEqual(bacnet_scan.deadline_concurrency(2, None), 2)
+        self.assertEqual(bacnet_scan.deadline_concurrency(2, (now, 100)), 2)
+        self.assertEqual(bacnet_scan.deadline_concurrency(2, (now - 60, 100)), 4)
+        self.assertEqual(bacnet_scan.deadline_concurrency(2, (now - 80, 100)), 8)
+
+class FakeTrendLogNetwork:
+    """
+    A device with one trendLog whose circular buffer keeps `size` records, answering
+    ReadRange requests of up to `max_count` records. `logging_rate` new records are
+    logged before each read, overwriting the oldest ones.
+    """
+    def __init__(self, total, size, max_count, logging_rate=0):
+        self.total = total
+        self.size = size
+        self.max_count = max_count
+        self.logging_rate = logging_rate
+        self.counts = []
+
+    def readMultiple(self, request):
+        return [self.total, min(self.total, self.size)]
+
+    def read_log_buffer(self, address, obj_type, obj_instance, sequence_number, count):
+        self.counts.append(count)
+        if count > self.max_count:
+            raise Exception("segmentationNotSupported")
+        self.total += self.logging_rate
+        oldest = max(self.total - self.size + 1, 1)
+        first = max(sequence_number, oldest)
+        last = min(first + count - 1, self.total)
+        records = [["2026-01-01T00:00:00.00", [["realValue", str(n)]], "[0, 0, 0, 0]"] for n in range(first, last + 1)]
+        return (first if records else None, records)
+
+class RowCollector:
+    def __init__(self):
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+
+class TestExportTrendLog(unittest.TestCase):
+
+    def test_chunk_size_adapts_to_the_device(self):
+        network = FakeTrendLogNetwork(total=200, size=200, max_count=40)
+        writer = RowCollector()
+        exported = bacnet_scan.export_trendlog(network, "192.168.1.20", 1001, "trendLog", 1, writer)
+        self.assertEqual(exported, 200)
+        self.assertEqual([row["sequence_number"] for row in writer.rows], list(range(1, 201)))
+        # 16 and 32 records are read, 64 fails and the chunk stays at 32 for the rest of the buffer
+        self.assertEqual(network.counts[:4], [16, 32, 64, 32])
+        self.assertEqual(max(network.counts[3:]), 32)
+
+    def test_overwritten_records_keep_their_sequence_numbers(self):
+        network = FakeTrendLogNetwork(total=100, size=50, max_count=256, logging_rate=20)
+        writer = RowCollector()
+        bacnet_scan.export_trendlog(network, "192.168.1.20", 1001, "trendLog", 1, writer)
+        sequence_numbers = [row["sequence_number"] for row in writer.rows]
+        self.assertEqual(sequence_numbers, [int(row["value"]) for row in writer.rows])
+        self.assertEqual(sequence_numbers, sorted(set(sequence_numbers)))
+        self.assertGreater(sequence_numbers[0], 51)
+
+class SilentNetwork:
+    """A device that sends its I-Am but never answers the reads of its properties"""
+    def __init__(self):
+        self.this_application = SimpleNamespace(i_am_counter={("192.168.1.20", 1001): 1})
+        self.release = threading.Event()
+
+    def readMultiple(self, request):
+        self.release.wait(10)
+        raise Exception("no response")
+
+class TestStreamDeviceList(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_streaming_stops_at_the_deadline(self):
+        network = SilentNetwork()
+        stream_filename = os.path.join(self.work_dir, "devices.csv")
+        start = time.time()
+        # The discovery and the quiet time would both outlast the deadline
+        rows = bacnet_scan.stream_device_list({"": network}, lambda bacnet: time.sleep(10), stream_filename, "csv", False,
+                                              2, 5, 3, [], deadline=(start, 0.5))
+        network.release.set()
+        self.assertLess(time.time() - start, 3)
+        self.assertEqual(rows, [])
+        stream = pd.read_csv(stream_filename)
+        self.assertEqual(list(stream["device_id"]), [1001])
+        self.assertEqual(list(stream["status"]), ["discovered"])
+
+class TestReplay(unittest.TestCase):
+    """Runs the scan offline against scans of two devices recorded with --record."""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def run_scan(self, *options):
+        cmd = ["python3", MAIN_SCRIPT, "-x", "replay.xlsx", "--replay-timing", "fast"] + list(options)
+        result = subprocess.run(cmd, capture_output=True, text=True, cwd=self.work_dir, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertNotIn("fatal error", result.stdout)
+        return os.path.join(self.work_dir, "bacnet_devices")
+
+    def test_replayed_scan_writes_the_point_lists(self):
+        output_path = self.run_scan("--replay", REPLAY_FILE)
+        sheets = pd.read_excel(os.path.join(output_path, "replay.xlsx"), sheet_name=None, index_col=0)
+        self.assertEqual(list(sheets), ["devices_list", "1001_AHU-1", "1002_VAV-1"])
+        self.assertEqual(list(sheets["1001_AHU-1"].index), ["supply_temp", "fan_status"])
+        self.assertEqual(list(sheets["1001_AHU-1"]["object"]), ["analogInput:1", "binaryInput:2"])
+        self.assertEqual(list(sheets["devices_list"]["device_serial_number"]), ["SN1001", "SN1002"])
+
+    def test_replayed_stream_scan_finds_the_recorded_i_ams(self):
+        start = time.time()
+        output_path = self.run_scan("-d", "--stream", "--replay", STREAM_REPLAY_FILE)
+        # Fast replay does not wait for the discovery to settle
+        self.assertLess(time.time() - start, 15)
+        stream = pd.read_csv(os.path.join(output_path, "replay_devicelist_stream.csv"))
+        self.assertEqual(sorted(stream[stream["status"] == "discovered"]["device_id"]), [1001, 1002])
+        complete = stream[stream["status"] == "complete"].set_index("device_id")
+        self.assertEqual(complete.loc[1002, "device_name"], "VAV-1")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+
+import unittest
+import importlib.util
+import os
+import json
+import time
+import tempfile
+import shutil
+import threading
+import urllib.request
+import urllib.error
+import pandas as pd
+
+# --- Configuration ---
+MAIN_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'udmi-commissioning.py'))
+
+def load_script():
+    """Imports udmi-commissioning.py, whose name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location("udmi_commissioning", MAIN_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+udmi = load_script()
+
+class TestComparisonRules(unittest.TestCase):
+
+    def compare(self, rules, cloud_values, local_values, object_types=None, points=None):
+        object_types = object_types or ["analogInput"] * len(cloud_values)
+        points = points or [("AHU-1", "supply_temp")] * len(cloud_values)
+        return list(udmi.ComparisonRules(rules).compare(
+            cloud_values, local_values, object_types, [device_id for device_id, point_name in points],
+            [point_name for device_id, point_name in points]))
+
+    def test_default_tolerance_absorbs_rounding_only(self):
+        self.assertEqual(self.compare(None, [21.5, 21.5, "21.5", 21.5], [21.5000001, 21.6, 21.5, "21.5"]),
+                         [True, False, True, True])
+
+    def test_states_compare_as_numbers(self):
+        self.assertEqual(self.compare(None, ["active", "true", 1, "on", "inactive"], [1, "active", "Active", True, 1]),
+                         [True, True, True, True, False])
+
+    def test_custom_states(self):
+        rules = {"states": {"Occupied": 1, "Unoccupied": 2}}
+        self.assertEqual(self.compare(rules, ["occupied", "unoccupied"], [1, 1]), [True, False])
+
+    def test_text_values_compare_normalized(self):
+        self.assertEqual(self.compare(None, ["Auto ", "hand"], ["auto", "off"]), [True, False])
+
+    def test_missing_values_do_not_match(self):
+        self.assertEqual(self.compare(None, [None, 21.5], [21.5, None]), [False, False])
+
+    def test_tolerances_by_object_type(self):
+        rules = {"types": {"analogInput": {"abs_tol": 0.5}}}
+        self.assertEqual(self.compare(rules, [21.0, 21.0, 21.0], [21.4, 21.6, 21.4],
+                                      ["analogInput", "analogInput", "analogValue"]),
+                         [True, False, False])
+
+    def test_relative_tolerance(self):
+        rules = {"types": {"analogInput": {"rel_tol": 0.01}}}
+        self.assertEqual(self.compare(rules, [1000.0, 1000.0], [1009.0, 1011.0]), [True, False])
+
+    def test_point_rules_take_precedence(self):
+        rules = {"types": {"analogInput": {"abs_tol": 0.5}}, "points": {"AHU-1/supply_temp": {"abs_tol": 0.01}}}
+        self.assertEqual(self.compare(rules, [21.0, 21.0], [21.4, 21.4], points=[("AHU-1", "supply_temp"), ("AHU-1", "return_temp")]),
+                         [False, True])
+
+    def test_local_values_are_scaled(self):
+        # A local value in degrees Fahrenheit compared with a cloud value in degrees Celsius
+        rules = {"points": {"AHU-1/supply_temp": {"scale": 5 / 9, "offset": -160 / 9, "abs_tol": 0.01}}}
+        self.assertEqual(self.compare(rules, [20.0, 20.0], [68.0, 70.0]), [True, False])
+
+    def test_empty_batch(self):
+        self.assertEqual(self.compare(None, [], []), [])
+
+def make_sheet(points):
+    """Builds an input sheet from (point name, object, cloud device id, cloud point name) tuples."""
+    sheet = pd.DataFrame([{"point_name": name, "object": obj, "cloud_device_id": device_id, "cloud_point_name": cloud_point_name}
+                          for name, obj, device_id, cloud_point_name in points]).set_index("point_name")
+    return sheet.astype(object)
+
+DEVICES = {"ahu_1": ("ahu_1", "Vendor", "192.168.1.20", 1001), "vav_1": ("vav_1", "Vendor", "192.168.1.21", 1002)}
+
+class TestParseTimestamp(unittest.TestCase):
+
+    def test_utc_timestamps(self):
+        self.assertEqual(udmi.parse_timestamp("2026-01-01T00:00:00Z"), 1767225600.0)
+        self.assertAlmostEqual(udmi.parse_timestamp("2026-01-01T00:00:00.5Z"), 1767225600.5)
+
+    def test_nanosecond_fraction_is_truncated_to_microseconds(self):
+        self.assertAlmostEqual(udmi.parse_timestamp("2026-01-01T00:00:00.123456789Z"), 1767225600.123456, places=6)
+
+    def test_invalid_timestamp(self):
+        self.assertIsNone(udmi.parse_timestamp("yesterday"))
+
+SAT = udmi.PointRef("ahu_1", "SAT", "192.168.1.20", "analogInput", "1", "site")
+
+class TestSampleStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = udmi.SampleStore([SAT], 4, max_distance=10)
+        for sample_time, value in ((100, 20.0), (110, 21.0), (120, 22.0)):
+            self.store.add(SAT, sample_time, value)
+
+    def test_nearest_sample(self):
+        self.assertEqual(self.store.aligned(SAT, 104), 20.0)
+        self.assertEqual(self.store.aligned(SAT, 106), 21.0)
+
+    def test_interpolated_sample(self):
+        self.assertAlmostEqual(self.store.aligned(SAT, 115, interpolate=True), 21.5)
+        # Outside the samples kept the nearest one is used
+        self.assertEqual(self.store.aligned(SAT, 125, interpolate=True), 22.0)
+
+    def test_binary_values_are_not_interpolated(self):
+        store = udmi.SampleStore([SAT], 4)
+        store.add(SAT, 100, "inactive")
+        store.add(SAT, 110, "active")
+        self.assertEqual(store.aligned(SAT, 104, interpolate=True), "inactive")
+
+    def test_oldest_samples_are_overwritten(self):
+        for sample_time in (130, 140):
+            self.store.add(SAT, sample_time, 23.0)
+        self.assertEqual(self.store.aligned(SAT, 100), 21.0)
+
+    def test_no_sample_close_to_the_cloud_timestamp(self):
+        self.assertIsNone(self.store.aligned(SAT, 50))
+        self.assertIsNone(self.store.aligned(SAT, 200, interpolate=True))
+        self.assertIsNone(udmi.SampleStore([SAT], 4).aligned(SAT, 100))
+
+class FakeBACnet:
+    """
+    A BACnet device at 192.168.1.20 whose analogInput N has the value N, answering
+    ReadPropertyMultiple requests of up to `max_points` points, or none at all
+    """
+    def __init__(self, max_points=None, rpm_supported=True, timeout=False):
+        self.max_points = max_points
+        self.rpm_supported = rpm_supported
+        self.timeout = timeout
+        self.requests = []
+
+    def readMultiple(self, request):
+        instances = [int(instance) for instance in request.split()[2::3]]
+        self.requests.append(("readMultiple", len(instances)))
+        if not self.rpm_supported:
+            raise udmi.BAC0.core.io.IOExceptions.UnrecognizedService()
+        if self.max_points is not None and len(instances) > self.max_points:
+            raise udmi.BAC0.core.io.IOExceptions.SegmentationNotSupported()
+        if self.timeout:
+            return [""]
+        return [float(instance) for instance in instances]
+
+    def read(self, request):
+        self.requests.append(("read", 1))
+        return float(request.split()[2])
+
+class TestReadPresentValues(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_bacnet = udmi.bacnet
+        udmi.rpm_unsupported.clear()
+        udmi.rpm_batch_sizes.clear()
+        self.refs = [udmi.PointRef("ahu_1", "P%d" % n, "192.168.1.20", "analogInput", str(n)) for n in range(1, 11)]
+
+    def tearDown(self):
+        udmi.bacnet = self.saved_bacnet
+        udmi.rpm_unsupported.clear()
+        udmi.rpm_batch_sizes.clear()
+
+    def read(self, bacnet, refs=None):
+        udmi.bacnet = bacnet
+        return udmi.read_present_values("192.168.1.20", refs or self.refs)
+
+    def test_points_are_read_in_one_request(self):
+        bacnet = FakeBACnet()
+        self.assertEqual(self.read(bacnet), [float(n) for n in range(1, 11)])
+        self.assertEqual(bacnet.requests, [("readMultiple", 10)])
+
+    def test_batches_are_halved_until_the_answer_fits(self):
+        bacnet = FakeBACnet(max_points=3)
+        self.assertEqual(self.read(bacnet), [float(n) for n in range(1, 11)])
+        self.assertEqual(bacnet.requests, [("readMultiple", 10), ("readMultiple", 5), ("readMultiple", 2),
+                                           ("readMultiple", 2), ("readMultiple", 2), ("readMultiple", 2), ("readMultiple", 2)])
+        # The next reads start with the smaller batches
+        bacnet.requests = []
+        self.read(bacnet, self.refs[:4])
+        self.assertEqual(bacnet.requests, [("readMultiple", 2), ("readMultiple", 2)])
+
+    def test_devices_without_read_property_multiple_are_read_point_by_point(self):
+        bacnet = FakeBACnet(rpm_supported=False)
+        self.assertEqual(self.read(bacnet, self.refs[:3]), [1.0, 2.0, 3.0])
+        self.assertEqual(bacnet.requests, [("readMultiple", 3), ("read", 1), ("read", 1), ("read", 1)])
+        self.assertIn("192.168.1.20", udmi.rpm_unsupported)
+        bacnet.requests = []
+        self.read(bacnet, self.refs[:2])
+        self.assertEqual(bacnet.requests, [("read", 1), ("read", 1)])
+
+    def test_timeout_is_no_response(self):
+        with self.assertRaises(udmi.BAC0.core.io.IOExceptions.NoResponseFromController):
+            self.read(FakeBACnet(timeout=True))
+        self.assertNotIn("192.168.1.20", udmi.rpm_unsupported)
+
+class TestValidatePoints(unittest.TestCase):
+    """Cloud values are compared with a local sample when one is close to their timestamp, and with a fresh read otherwise"""
+
+    def setUp(self):
+        self.saved = {name: getattr(udmi, name) for name in ("sample_store", "read_present_values", "record_validations")}
+        udmi.sample_store = udmi.SampleStore([SAT], 4, max_distance=10)
+        udmi.sample_store.add(SAT, udmi.parse_timestamp("2026-01-01T00:00:00Z"), 20.0)
+        self.reads = []
+        self.recorded = []
+        udmi.read_present_values = lambda address, refs: self.reads.extend(refs) or [25.0] * len(refs)
+        udmi.record_validations = lambda items, local_values: self.recorded.extend(zip(items, local_values))
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(udmi, name, value)
+
+    def validate(self, timestamp):
+        udmi.validate_points([udmi.ValidationItem(SAT, "AHU-1", "supply_temp", 20.0, timestamp)])
+        return [local_value for item, local_value in self.recorded]
+
+    def test_sample_near_the_cloud_timestamp(self):
+        self.assertEqual(self.validate("2026-01-01T00:00:05.000000001Z"), [20.0])
+        self.assertEqual(self.reads, [])
+
+    def test_cloud_timestamp_out_of_range_is_read_again(self):
+        self.assertEqual(self.validate("2026-01-01T01:00:00Z"), [25.0])
+        self.assertEqual(self.reads, [SAT])
+
+class TestBuildPointIndex(unittest.TestCase):
+
+    def test_points_without_a_valid_object_are_not_mapped(self):
+        sheets = {"ahu_1": make_sheet([("SAT", "", "AHU-1", "supply_temp"), ("RAT", "analogInput", "AHU-1", "return_temp"),
+                                       ("MAT", "analogInput:3", "AHU-1", "mixed_temp")])}
+        self.assertEqual(list(udmi.build_point_index(sheets, DEVICES, "site")), [("AHU-1", "mixed_temp")])
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.sheets = {
+            "ahu_1": make_sheet([("SAT", "analogInput:1", "AHU-1", "supply_temp"), ("RAT", "analogInput:2", "AHU-1", "return_temp")]),
+            "vav_1": make_sheet([("ZT", "analogInput:1", "VAV-1", "zone_temp")])
+        }
+        self.store = udmi.ResultStore(udmi.build_point_index(self.sheets, DEVICES, "site"))
+        self.record_all(self.store, 21.0)
+
+    def record_all(self, store, local_value):
+        items = [udmi.ValidationItem(ref, device_id, point_name, 21.0, "2026-01-01T00:00:00Z")
+                 for ref, device_id, point_name in zip(store.refs, store.device_ids, store.point_names)]
+        store.record(items, [local_value] * len(items), [local_value == 21.0] * len(items))
+
+    def statuses(self, store):
+        return {(ref.sheet, ref.row): (udmi.STATUS_NAMES[state], int(seen)) for ref, state, seen in zip(store.refs, store.states, store.seen)}
+
+    def test_unchanged_mapping_keeps_every_result(self):
+        kept = self.store.update(udmi.build_point_index(self.sheets, DEVICES, "site"))
+        self.assertEqual(kept, 3)
+        self.assertEqual(set(status for status, seen in self.statuses(self.store).values()), {"VALIDATED"})
+
+    def test_remapped_points_are_pending_again(self):
+        self.sheets["ahu_1"] = make_sheet([("SAT", "analogInput:1", "AHU-1", "discharge_temp"), ("RAT", "analogInput:3", "AHU-1", "return_temp")])
+        kept = self.store.update(udmi.build_point_index(self.sheets, DEVICES, "site"))
+        self.assertEqual(kept, 1)
+        self.assertEqual(self.statuses(self.store), {
+            ("ahu_1", "SAT"): ("", 0),
+            ("ahu_1", "RAT"): ("", 0),
+            ("vav_1", "ZT"): ("VALIDATED", 1)
+        })
+
+    def test_removed_and_added_points(self):
+        self.sheets["ahu_1"] = make_sheet([("SAT", "analogInput:1", "AHU-1", "supply_temp"), ("FAN", "binaryInput:1", "AHU-1", "fan_status")])
+        del self.sheets["vav_1"]
+        kept = self.store.update(udmi.build_point_index(self.sheets, DEVICES, "site"))
+        self.assertEqual(kept, 1)
+        self.assertEqual(self.statuses(self.store), {("ahu_1", "SAT"): ("VALIDATED", 1), ("ahu_1", "FAN"): ("", 0)})
+        self.assertEqual(set(self.store.locks), {"ahu_1"})
+
+    def test_results_of_points_no_longer_mapped_are_ignored(self):
+        old_refs = list(self.store.refs)
+        self.sheets["ahu_1"] = make_sheet([("SAT", "analogInput:5", "AHU-1", "supply_temp"), ("RAT", "analogInput:2", "AHU-1", "return_temp")])
+        self.store.update(udmi.build_point_index(self.sheets, DEVICES, "site"))
+        stale = udmi.ValidationItem(old_refs[0], "AHU-1", "supply_temp", 21.0, "2026-01-01T00:00:00Z")
+        self.store.record([stale], [20.0], [False])
+        self.assertEqual(self.statuses(self.store)[("ahu_1", "SAT")], ("", 0))
+
+    def test_results_of_points_moved_to_another_device_are_ignored(self):
+        self.sheets["ahu_1"] = make_sheet([("SAT", "analogInput:1", "AHU-2", "supply_temp"), ("RAT", "analogInput:2", "AHU-1", "return_temp")])
+        self.store.update(udmi.build_point_index(self.sheets, DEVICES, "site"))
+        stale = udmi.ValidationItem(self.store.refs[self.store.rows[("ahu_1", "SAT")]], "AHU-1", "supply_temp", 99.0, "2026-01-01T00:00:00Z")
+        self.store.record([stale], [20.0], [False])
+        self.assertEqual(self.statuses(self.store)[("ahu_1", "SAT")], ("", 0))
+
+    def test_to_sheets_writes_the_checked_points(self):
+        self.store.update(udmi.build_point_index(dict(self.sheets, ahu_1=make_sheet(
+            [("SAT", "analogInput:1", "AHU-1", "supply_temp"), ("RAT", "analogInput:2", "AHU-1", "mixed_temp")])), DEVICES, "site"))
+        sheets = self.store.to_sheets(self.sheets)
+        self.assertEqual(sheets["ahu_1"].loc["SAT", "validation_status"], "VALIDATED")
+        self.assertTrue(pd.isna(sheets["ahu_1"].loc["RAT", "validation_status"]))
+        self.assertNotIn("validation_status", self.sheets["ahu_1"].columns)
+
+class TestMessageFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.site = udmi.Site("site")
+        self.site.watched_devices = {"AHU-1"}
+
+    def test_pointset_events_with_missing_or_empty_sub_type_are_watched(self):
+        self.assertTrue(udmi.is_watched_pointset({"deviceId": "AHU-1", "subFolder": "pointset"}, self.site))
+        self.assertTrue(udmi.is_watched_pointset({"deviceId": "AHU-1", "subFolder": "pointset", "subType": ""}, self.site))
+
+    def test_other_messages_are_not_watched(self):
+        self.assertFalse(udmi.is_watched_pointset({"deviceId": "AHU-1", "subFolder": "pointset", "subType": "state"}, self.site))
+        self.assertFalse(udmi.is_watched_pointset({"deviceId": "AHU-1", "subFolder": "system"}, self.site))
+        self.assertFalse(udmi.is_watched_pointset({"deviceId": "AHU-2", "subFolder": "pointset"}, self.site))
+
+    def test_subscription_filter_accepts_a_missing_sub_type(self):
+        self.assertEqual(udmi.subscription_filter({"AHU-2", "AHU-1"}),
+                         'attributes.subFolder = "pointset" AND (attributes.subType = "" OR NOT attributes:subType) '
+                         'AND (attributes.deviceId = "AHU-1" OR attributes.deviceId = "AHU-2")')
+
+    def test_subscription_filter_without_devices_when_too_long(self):
+        device_ids = {"AHU-%d" % n for n in range(20)}
+        self.assertEqual(udmi.subscription_filter(device_ids),
+                         'attributes.subFolder = "pointset" AND (attributes.subType = "" OR NOT attributes:subType)')
+        self.assertLessEqual(len(udmi.subscription_filter(device_ids)), udmi.FILTER_MAX_LENGTH)
+
+class QueuedMessage:
+    def __init__(self, device_id, points):
+        self.data = json.dumps({"timestamp": "2026-01-01T00:00:00Z",
+                                "points": {name: {"present_value": value} for name, value in points.items()}}).encode("utf-8")
+        self.attributes = {"deviceId": device_id, "subFolder": "pointset"}
+        self.publish_time = None
+
+class TestPointsetItems(unittest.TestCase):
+
+    def setUp(self):
+        sheets = {"ahu_1": make_sheet([("SAT", "analogInput:1", "AHU-1", "supply_temp")])}
+        self.site = udmi.Site("site")
+        self.site.point_index = udmi.build_point_index(sheets, DEVICES, "site")
+        self.site.watched_devices = {"AHU-1"}
+
+    def items(self, messages):
+        return udmi.pointset_items(messages, udmi.point_index_frame(self.site.point_index), self.site)
+
+    def test_mapped_points_are_matched(self):
+        items = self.items([QueuedMessage("AHU-1", {"supply_temp": 21.0, "return_temp": 23.0})])
+        self.assertEqual([(item.point_name, item.cloud_value) for item in items], [("supply_temp", 21.0)])
+
+    def test_malformed_payloads_are_skipped(self):
+        malformed = []
+        for data in (b"not json", b"[1, 2]", b'{"points": {"supply_temp": 21.0}}', b'{"points": []}'):
+            message = QueuedMessage("AHU-1", {})
+            message.data = data
+            malformed.append(message)
+        items = self.items(malformed + [QueuedMessage("AHU-1", {"supply_temp": 22.0})])
+        self.assertEqual([item.cloud_value for item in items], [22.0])
+
+class TestDurableQueue(unittest.TestCase):
+    """Messages stay in the queue until the points they hold are recorded"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.work_dir, "queue.sqlite")
+        self.consumed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def consume(self, message):
+        # Each point of the message is an item waiting to be read
+        points = json.loads(message.data)["points"]
+        self.queue.decoded(message.queue_id, len(points))
+        self.consumed.append((message.queue_id, list(points)))
+
+    def open_queue(self):
+        self.consumed = []
+        self.queue = udmi.DurableQueue(self.filename, self.consume, lambda attributes: True)
+        return self.queue
+
+    def wait_consumed(self, count):
+        for n in range(100):
+            if len(self.consumed) >= count:
+                return
+            time.sleep(0.05)
+        self.fail("%d message(s) consumed, %d expected" % (len(self.consumed), count))
+
+    def test_message_is_deleted_once_all_its_points_are_recorded(self):
+        queue = self.open_queue()
+        queue.put_many([QueuedMessage("AHU-1", {"supply_temp": 21.0, "return_temp": 23.0})])
+        self.wait_consumed(1)
+        queue_id = self.consumed[0][0]
+        queue.recorded([queue_id])
+        self.assertEqual(queue.size(), 1)
+        queue.recorded([queue_id])
+        self.assertEqual(queue.size(), 0)
+
+    def test_message_without_points_is_deleted_when_decoded(self):
+        queue = self.open_queue()
+        queue.put_many([QueuedMessage("AHU-1", {})])
+        self.wait_consumed(1)
+        self.assertEqual(queue.size(), 0)
+
+    def test_unrecorded_messages_are_consumed_again_after_a_restart(self):
+        queue = self.open_queue()
+        queue.put_many([QueuedMessage("AHU-1", {"supply_temp": 21.0}), QueuedMessage("AHU-2", {"supply_temp": 22.0})])
+        self.wait_consumed(2)
+        queue.recorded([self.consumed[0][0]])
+        queue.connection.close()
+        self.open_queue()
+        self.wait_consumed(1)
+        self.assertEqual(self.consumed, [(2, ["supply_temp"])])
+
+    def test_replaced_values_keep_their_messages_queued(self):
+        sheets = {"ahu_1": make_sheet([("SAT", "analogInput:1", "AHU-1", "supply_temp")])}
+        ref = udmi.build_point_index(sheets, DEVICES, "site")[("AHU-1", "supply_temp")][0]
+        pool = udmi.ReaderPool(0, None)
+        pool.put(udmi.ValidationItem(ref, "AHU-1", "supply_temp", 21.0, "2026-01-01T00:00:00Z", None, (1,)))
+        pool.put(udmi.ValidationItem(ref, "AHU-1", "supply_temp", 21.5, "2026-01-01T00:01:00Z", None, (2,)))
+        item, = pool.queues[ref.address].values()
+        self.assertEqual((item.cloud_value, item.queue_ids), (21.5, (1, 2)))
+
+class TestReloadSite(unittest.TestCase):
+    """Edits of the input workbook saved by xlsxwriter, which keeps the text cells in the shared strings"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.input = os.path.join(self.work_dir, "input.xlsx")
+        self.sheets = {
+            "ahu_1": make_sheet([("SAT", "analogInput:1", "AHU-1", "supply_temp"), ("RAT", "analogInput:2", "AHU-1", "return_temp")]),
+            "vav_1": make_sheet([("ZT", "analogInput:1", "VAV-1", "zone_temp")])
+        }
+        self.save()
+        self.site = udmi.Site("site", input=self.input)
+        self.site.devices.update(DEVICES)
+        self.site.devices_points.update(udmi.load_sheets(self.input))
+        self.site.sheet_digests = udmi.sheet_digests(self.input)
+        self.site.point_index = udmi.site_point_index(self.site, self.site.devices_points)
+        self.site.results = udmi.ResultStore(self.site.point_index)
+        self.site.coverage = udmi.CoverageTracker(self.site.results, target=1.0)
+        items = [udmi.ValidationItem(ref, device_id, point_name, 21.0, "2026-01-01T00:00:00Z")
+                 for ref, device_id, point_name in zip(self.site.results.refs, self.site.results.device_ids, self.site.results.point_names)]
+        self.site.record(items, [21.0] * len(items), [True] * len(items), 0.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def save(self):
+        with pd.ExcelWriter(self.input, engine="xlsxwriter") as writer:
+            for sheet_name, sheet in self.sheets.items():
+                sheet.to_excel(writer, sheet_name=sheet_name)
+
+    def test_digests_change_with_the_shared_strings(self):
+        digests = udmi.sheet_digests(self.input)
+        self.assertEqual(list(digests), ["ahu_1", "vav_1"])
+        self.sheets["ahu_1"].loc["SAT", "cloud_point_name"] = "discharge_temp"
+        self.save()
+        changed = udmi.sheet_digests(self.input)
+        self.assertNotEqual(changed["ahu_1"], digests["ahu_1"])
+        self.assertEqual(changed["vav_1"], digests["vav_1"])
+
+    def test_digests_are_none_for_other_formats(self):
+        csv_file = os.path.join(self.work_dir, "input.csv")
+        self.sheets["ahu_1"].to_csv(csv_file)
+        self.assertIsNone(udmi.sheet_digests(csv_file))
+
+    def test_renamed_cloud_point_is_remapped(self):
+        self.sheets["ahu_1"].loc["SAT", "cloud_point_name"] = "discharge_temp"
+        self.save()
+        udmi.reload_site(self.site)
+        self.assertIn(("AHU-1", "discharge_temp"), self.site.point_index)
+        self.assertNotIn(("AHU-1", "supply_temp"), self.site.point_index)
+        self.assertEqual(self.site.index_version, 1)
+        states = {(ref.sheet, ref.row): udmi.STATUS_NAMES[state] for ref, state in zip(self.site.results.refs, self.site.results.states)}
+        self.assertEqual(states, {("ahu_1", "SAT"): "", ("ahu_1", "RAT"): "VALIDATED", ("vav_1", "ZT"): "VALIDATED"})
+
+    def test_unchanged_file_is_not_reloaded(self):
+        self.save()
+        udmi.reload_site(self.site)
+        self.assertEqual(self.site.index_version, 0)
+
+    def test_added_points_clear_the_coverage_target(self):
+        self.assertTrue(self.site.coverage.reached.is_set())
+        self.sheets["vav_1"] = make_sheet([("ZT", "analogInput:1", "VAV-1", "zone_temp"), ("DMP", "analogOutput:1", "VAV-1", "damper")])
+        self.save()
+        udmi.reload_site(self.site)
+        self.assertFalse(self.site.coverage.reached.is_set())
+
+class TestStatusApi(unittest.TestCase):
+
+    def setUp(self):
+        site = udmi.Site("site")
+        site.mismatches.extend({"device_id": "AHU-1", "point_name": "supply_temp", "value": n} for n in range(5))
+        udmi.sites["site"] = site
+        self.server = udmi.ThreadingHTTPServer(("127.0.0.1", 0), udmi.StatusRequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        del udmi.sites["site"]
+
+    def get(self, path):
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:%d%s" % (self.server.server_address[1], path)) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    def test_latest_mismatches_first(self):
+        status, body = self.get("/mismatches?limit=2")
+        self.assertEqual(status, 200)
+        self.assertEqual([mismatch["value"] for mismatch in body["site"]], [4, 3])
+
+    def test_negative_limit_returns_nothing(self):
+        self.assertEqual(self.get("/mismatches?limit=-1"), (200, {"site": []}))
+
+    def test_invalid_limit_is_a_bad_request(self):
+        status, body = self.get("/mismatches?limit=ten")
+        self.assertEqual(status, 400)
+        self.assertIn("error", body)
+
+if __name__ == '__main__':
+    unittest.main()
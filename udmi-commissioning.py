@@ -19,14 +19,32 @@ __email__ = "francesco.anselmo@gmail.com"
 __status__ = "Dev"
 
 from os.path import exists
-from pprint import pprint
+from xml.etree import ElementTree
+import os
+import re
 import signal
+import time
 import json
+import pickle
+import sqlite3
+import hashlib
+import zipfile
+import zlib
 import argparse
 import pandas as pd
+import numpy as np
 import BAC0
+import threading
+import multiprocessing
+from collections import namedtuple, deque, OrderedDict
+from datetime import datetime
+from functools import partial
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures import TimeoutError
 from google.cloud import pubsub_v1
+from google.api_core.exceptions import DeadlineExceeded, AlreadyExists
 from tabulate import tabulate
 from pyfiglet import *
 
@@ -80,25 +98,926 @@ def make_points(dev):
     return df
 
 def make_sheet(dfs, excel_filename):
-    with pd.ExcelWriter(excel_filename) as writer:
+    # The sheets are written to a temporary file renamed over the output file,
+    # so an interrupted write never leaves a truncated output file behind
+    root, extension = os.path.splitext(excel_filename)
+    temp_filename = root + ".tmp" + extension
+    with pd.ExcelWriter(temp_filename) as writer:
         for k, v in dfs.items():
             v.to_excel(writer, sheet_name=k)
+    os.replace(temp_filename, excel_filename)
     print("Devices point lists written to file %s" % excel_filename)
 
-def get_sheet_dict(sheet_file, sheet_name):
-    dataframe = pd.read_excel(sheet_file, sheet_name, dtype=str, header=[0], index_col=[0])
-
+def clean_sheet(dataframe):
     # Replace "nan" values with empty whitespaces
     dataframe = dataframe.fillna("")
 
-    # Remove all trailing whitespaces
-    for column in dataframe.columns:
-      dataframe[column] = dataframe[column].apply(
-        lambda dataframe_column: dataframe_column.strip()
-      )
+    # Remove all trailing whitespaces, the object dtype lets the validation results be written back as numbers
+    return dataframe.apply(lambda column: column.str.strip()).astype(object)
+
+def get_sheet_dict(sheet_file, sheet_name):
+    dataframe = pd.read_excel(sheet_file, sheet_name, dtype=str, header=[0], index_col=[0])
 
     # return dataframe.to_dict('records')
-    return dataframe
+    return clean_sheet(dataframe)
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_sheets(sheet_file, cache_file=None):
+    """Read all the sheets of the input file in one pass, reusing the sheets
+    cached in cache_file when the input file has not changed since
+    """
+    sheet_hash = file_hash(sheet_file)
+    if cache_file is not None and exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached["sha256"] == sheet_hash:
+                print("Sheets loaded from cache %s" % cache_file)
+                return cached["sheets"]
+        except Exception as e:
+            print("Could not read the sheets cache %s: %s" % (cache_file, e))
+    sheets = pd.read_excel(sheet_file, sheet_name=None, dtype=str, header=[0], index_col=[0])
+    sheets = {sheet_name: clean_sheet(dataframe) for sheet_name, dataframe in sheets.items()}
+    if cache_file is not None:
+        try:
+            with open(cache_file + ".tmp", "wb") as f:
+                pickle.dump({"sha256": sheet_hash, "sheets": sheets}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_file + ".tmp", cache_file)
+        except Exception as e:
+            print("Could not write the sheets cache %s: %s" % (cache_file, e))
+    return sheets
+
+# Namespaces of the .xlsx workbook parts listing the sheets
+XLSX_NAMESPACES = {"main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+                   "relationships": "http://schemas.openxmlformats.org/officeDocument/2006/relationships"}
+
+def sheet_digests(sheet_file):
+    """Return the SHA-256 of the worksheet XML of every sheet of an .xlsx file,
+    by sheet name, or None for the other file formats
+
+    The text cells of the sheets are indexes into the shared strings part of the
+    workbook, so the digest of a sheet includes the shared strings of its cells.
+    """
+    if not zipfile.is_zipfile(sheet_file):
+        return None
+    with zipfile.ZipFile(sheet_file) as workbook:
+        if "xl/workbook.xml" not in workbook.namelist():
+            return None
+        book = ElementTree.fromstring(workbook.read("xl/workbook.xml"))
+        relationships = ElementTree.fromstring(workbook.read("xl/_rels/workbook.xml.rels"))
+        targets = {relationship.get("Id"): relationship.get("Target") for relationship in relationships}
+        part_name = lambda target: target.lstrip("/") if target.startswith("/") else "xl/" + target
+        shared_strings = []
+        for relationship in relationships:
+            if relationship.get("Type", "").endswith("/sharedStrings"):
+                strings = ElementTree.fromstring(workbook.read(part_name(relationship.get("Target"))))
+                shared_strings = [ElementTree.tostring(string) for string in strings.findall("main:si", XLSX_NAMESPACES)]
+        digests = {}
+        for sheet in book.find("main:sheets", XLSX_NAMESPACES):
+            target = targets[sheet.get("{%s}id" % XLSX_NAMESPACES["relationships"])]
+            worksheet = workbook.read(part_name(target))
+            digest = hashlib.sha256(worksheet)
+            if shared_strings:
+                for cell in ElementTree.fromstring(worksheet).iter("{%s}c" % XLSX_NAMESPACES["main"]):
+                    value = cell.find("main:v", XLSX_NAMESPACES)
+                    if cell.get("t") == "s" and value is not None and value.text.isdigit() and int(value.text) < len(shared_strings):
+                        digest.update(shared_strings[int(value.text)])
+            digests[sheet.get("name")] = digest.hexdigest()
+        return digests
+
+# Local point mapped to a cloud point: the input sheet and row it comes from,
+# the BACnet address and object used to read its present value and its site
+PointRef = namedtuple("PointRef", ["sheet", "row", "address", "object_type", "object_instance", "site"], defaults=(None,))
+
+def build_point_index(devices_points, devices, site=None):
+    """Build the lookup index used by message_callback, mapping each
+    (cloud_device_id, cloud_point_name) to the local points it is mapped to
+    """
+    index = {}
+    for sheet_name, device_points in devices_points.items():
+        if "cloud_device_id" not in device_points.columns or "cloud_point_name" not in device_points.columns:
+            continue
+        if sheet_name not in devices:
+            print("Device %s was not discovered, its points will not be validated" % sheet_name)
+            continue
+        address = devices[sheet_name][2]
+        mapped = device_points[(device_points["cloud_device_id"] != "") & (device_points["cloud_point_name"] != "")]
+        for row, cloud_device_id, cloud_point_name, object in zip(mapped.index.tolist(), mapped["cloud_device_id"], mapped["cloud_point_name"], mapped["object"]):
+            object_type, separator, object_instance = str(object).partition(":")
+            if object_type == "" or object_instance == "":
+                print("Point %s of %s has no valid BACnet object (%r), it will not be validated" % (row, sheet_name, object))
+                continue
+            index.setdefault((cloud_device_id, cloud_point_name), []).append(
+                PointRef(sheet_name, row, address, object_type, object_instance, site))
+    return index
+
+# Time in seconds to wait for the I-Am answers to the targeted Who-Is requests
+SEED_WHOIS_WAIT = 3
+# Number of threads checking the seeded device addresses
+SEED_CHECK_WORKERS = 16
+
+def seed_devices(devices_list, sheet_names):
+    """Build the device map from the devices_list sheet of the input file, matching
+    each sheet by device name, sanitized device name or device_id_ prefix
+    """
+    by_name = {}
+    by_id = {}
+    for row in devices_list.to_dict("records"):
+        if row.get("device_id", "") == "":
+            continue
+        device = (row.get("device_name", ""), row.get("device_vendor", ""), row.get("ip_address", ""), int(row["device_id"]))
+        by_id[row["device_id"]] = device
+        for name in (row.get("device_name", ""), row.get("sanitized_device_name", "")):
+            if name != "":
+                by_name[name] = device
+    seeded = {}
+    for sheet_name in sheet_names:
+        device = by_name.get(sheet_name) or by_id.get(sheet_name.split("_")[0])
+        if device is not None:
+            seeded[sheet_name] = device
+    return seeded
+
+def device_responds(address, device_id):
+    try:
+        return bacnet.read("%s device %d objectName" % (address, device_id)) is not None
+    except Exception:
+        return False
+
+def locate_devices(device_ids):
+    """Send a targeted Who-Is for each device id and return the addresses of those that answered"""
+    for device_id in device_ids:
+        bacnet.whois("%d %d" % (device_id, device_id), global_broadcast=True)
+    time.sleep(SEED_WHOIS_WAIT)
+    return {device_id: str(address) for address, device_id in list(bacnet.this_application.i_am_counter) if device_id in device_ids}
+
+def check_seeded_devices(seeded):
+    """Check the seeded addresses with a read of each device and look up the
+    missing or stale ones with targeted Who-Is requests
+    """
+    addresses = {device[3]: device[2] for device in seeded.values() if device[2] != ""}
+    with ThreadPoolExecutor(max_workers=SEED_CHECK_WORKERS) as executor:
+        responding = dict(zip(addresses, executor.map(device_responds, addresses.values(), addresses.keys())))
+    lost = set(device[3] for device in seeded.values() if not responding.get(device[3], False))
+    found = locate_devices(lost) if lost else {}
+    if lost:
+        print("%d device(s) with missing or stale address, %d found with Who-Is" % (len(lost), len(found)))
+    checked = {}
+    for sheet_name, device in seeded.items():
+        name, vendor, address, device_id = device
+        if device_id in found:
+            checked[sheet_name] = (name, vendor, found[device_id], device_id)
+        elif device_id not in lost:
+            checked[sheet_name] = device
+    return checked
+
+# Cloud value received for a mapped point, waiting to be compared with the local value,
+# with the time its message was received and the ids of the durable queue messages it stands for
+ValidationItem = namedtuple("ValidationItem", ["ref", "device_id", "point_name", "cloud_value", "timestamp", "received", "queue_ids"],
+                            defaults=(None, ()))
+
+# Estimated size in bytes of one presentValue result in a ReadPropertyMultiple
+# response (object identifier, property identifier, context tags and value)
+RPM_BYTES_PER_POINT = 24
+# Size in bytes of the APDU header of a ReadPropertyMultiple response
+RPM_HEADER_BYTES = 16
+# Time in seconds the readers are given to read the points still queued when the session ends
+READER_DRAIN_TIMEOUT = 60
+
+class ReaderPool:
+    """Pool of BACnet reader threads validating the points queued by message_callback
+
+    Work is queued per BACnet device and the devices are served in turn, so a
+    slow device does not hold up the others. Only the latest cloud value of a
+    point is kept while it waits, which bounds the queue to the number of mapped points;
+    it inherits the durable queue messages of the values it replaces.
+    A reader waits for the coalescing window after picking a device and then takes
+    up to batch_size of its points, so they can be read in one request.
+    """
+    def __init__(self, workers, validate, coalesce=0.0, batch_size=1):
+        self.validate = validate
+        self.coalesce = coalesce
+        self.batch_size = batch_size
+        self.queues = {}
+        self.ready = deque()
+        self.busy = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.threads = [threading.Thread(target=self.run, name="bacnet-reader-%d" % n, daemon=True) for n in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        with self.condition:
+            self.add(item)
+            self.condition.notify()
+
+    def put_many(self, items):
+        with self.condition:
+            for item in items:
+                self.add(item)
+            self.condition.notify_all()
+
+    def add(self, item):
+        address = item.ref.address
+        if address not in self.queues:
+            self.queues[address] = OrderedDict()
+            self.ready.append(address)
+        replaced = self.queues[address].get(item.ref)
+        if replaced is not None and replaced.queue_ids:
+            item = item._replace(queue_ids=replaced.queue_ids + item.queue_ids)
+        self.queues[address][item.ref] = item
+
+    def get(self):
+        with self.condition:
+            while self.running and not self.ready:
+                self.condition.wait()
+            if not self.running:
+                return None
+            # The device stays queued but not ready while its points are coalescing
+            address = self.ready.popleft()
+            self.busy += 1
+        if self.coalesce > 0:
+            time.sleep(self.coalesce)
+        with self.condition:
+            queue = self.queues[address]
+            items = [queue.popitem(last=False)[1] for n in range(min(self.batch_size, len(queue)))]
+            if queue:
+                self.ready.append(address)
+                self.condition.notify()
+            else:
+                del self.queues[address]
+            return items
+
+    def run(self):
+        while True:
+            items = self.get()
+            if items is None:
+                return
+            try:
+                self.validate(items)
+            except Exception as error:
+                print("Error reading %d point(s) from %s: %s" % (len(items), items[0].ref.address, error))
+            with self.condition:
+                self.busy -= 1
+                self.condition.notify_all()
+
+    def pending(self):
+        with self.condition:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def wait_idle(self, timeout=None):
+        """Wait until all the queued points have been read, return False on timeout"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queues and self.busy == 0, timeout)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+class ValueCache:
+    """Cache of the values read from the local BACnet points, keyed by
+    (address, object, instance), so cloud values received again within the TTL
+    are compared with the cached reading instead of reading the point again
+
+    The least recently used values are evicted when max_size is reached.
+    """
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self.values.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.values[key] = (time.time(), value)
+            self.values.move_to_end(key)
+            while len(self.values) > self.max_size:
+                self.values.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            hit_rate = 100.0 * self.hits / total if total else 0.0
+            return "cache: %d hits, %d misses (%.1f%% hit rate), %d values" % (self.hits, self.misses, hit_rate, len(self.values))
+
+def report_stats(interval):
+    """Print the reader pool and cache counters every interval seconds
+    """
+    while True:
+        time.sleep(interval)
+        print_stats()
+
+def print_stats():
+    stats = ["%d point(s) waiting to be read" % reader_pool.pending()]
+    if value_cache is not None:
+        stats.append(value_cache.stats())
+    if len(sites) == 1:
+        stats.extend(site.stats() for site in sites.values())
+    print("[stats] " + ", ".join(stats))
+    if len(sites) > 1:
+        for site in sites.values():
+            print("[stats %s] %s" % (site.name, site.stats()))
+
+class SampleStore:
+    """Ring buffers of the latest local samples of each mapped point
+
+    Every point owns a fixed size row of sample times, values as floats (NaN
+    when the value is not numeric) and raw values, overwritten oldest first.
+    Samples further than max_distance seconds from a cloud timestamp are not used.
+    """
+    def __init__(self, refs, size, max_distance=None):
+        self.rows = {ref: row for row, ref in enumerate(refs)}
+        self.size = size
+        self.max_distance = max_distance
+        self.times = np.full((len(refs), size), np.nan)
+        self.values = np.full((len(refs), size), np.nan)
+        self.raw_values = np.empty((len(refs), size), dtype=object)
+        self.heads = np.zeros(len(refs), dtype=np.int64)
+        self.lock = threading.Lock()
+
+    def add_refs(self, refs):
+        refs = [ref for ref in refs if ref not in self.rows]
+        if not refs:
+            return
+        with self.lock:
+            self.times = np.vstack([self.times, np.full((len(refs), self.size), np.nan)])
+            self.values = np.vstack([self.values, np.full((len(refs), self.size), np.nan)])
+            self.raw_values = np.vstack([self.raw_values, np.empty((len(refs), self.size), dtype=object)])
+            self.heads = np.concatenate([self.heads, np.zeros(len(refs), dtype=np.int64)])
+            first_row = len(self.rows)
+            self.rows.update((ref, first_row + n) for n, ref in enumerate(refs))
+
+    def add(self, ref, sample_time, value):
+        row = self.rows[ref]
+        with self.lock:
+            column = self.heads[row] % self.size
+            self.times[row, column] = sample_time
+            self.values[row, column] = sample_to_float(value)
+            self.raw_values[row, column] = value
+            self.heads[row] += 1
+
+    def aligned(self, ref, target_time, interpolate=False):
+        """Return the local value of a point at target_time: the nearest sample,
+        or the value interpolated between the samples around it, None without
+        samples close enough to target_time
+        """
+        row = self.rows.get(ref)
+        if row is None:
+            return None
+        with self.lock:
+            times = self.times[row].copy()
+            values = self.values[row].copy()
+            raw_values = self.raw_values[row].copy()
+        valid = ~np.isnan(times)
+        if not valid.any():
+            return None
+        times, values, raw_values = times[valid], values[valid], raw_values[valid]
+        order = np.argsort(times)
+        times, values, raw_values = times[order], values[order], raw_values[order]
+        nearest = int(np.argmin(np.abs(times - target_time)))
+        if self.max_distance is not None and abs(times[nearest] - target_time) > self.max_distance:
+            # The cloud value is older or newer than the samples kept, it is read from the device instead
+            return None
+        if interpolate and times[0] <= target_time <= times[-1]:
+            after = int(np.searchsorted(times, target_time))
+            before = max(after - 1, 0)
+            # Binary and multistate values are not interpolated
+            if all(isinstance(raw_values[n], float) for n in (before, after)):
+                return float(np.interp(target_time, times[before:after + 1], values[before:after + 1]))
+        return raw_values[nearest]
+
+def sample_to_float(value):
+    if isinstance(value, (bool, int, float)):
+        return float(value)
+    if value in ("active", "inactive"):
+        return 1.0 if value == "active" else 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+TIMESTAMP_FRACTION = re.compile(r"\.(\d+)")
+
+def parse_timestamp(timestamp):
+    """Convert a UDMI timestamp (ISO 8601, e.g. 2024-05-01T10:00:00.123Z) to seconds since the epoch
+    """
+    text = str(timestamp).replace("Z", "+00:00")
+    # Before Python 3.11 fromisoformat only accepts fractions of 3 or 6 digits, UDMI timestamps can have up to 9
+    text = TIMESTAMP_FRACTION.sub(lambda match: "." + match.group(1)[:6].ljust(6, "0"), text, count=1)
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        return None
+
+def sample_points(interval, workers, batch_size):
+    """Read all the mapped points every interval seconds into the sample store,
+    one batch of points of the same BACnet device per read
+    """
+    def sample_batch(address, refs):
+        try:
+            local_values = read_present_values(address, refs)
+        except Exception as error:
+            print("Error sampling %d point(s) from %s: %s" % (len(refs), address, error))
+            return
+        sample_time = time.time()
+        for ref, local_value in zip(refs, local_values):
+            sample_store.add(ref, sample_time, local_value)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            started = time.time()
+            # The batches are made again every round, as points are added when the input file is reloaded
+            refs_by_address = {}
+            for ref in list(sample_store.rows):
+                refs_by_address.setdefault(ref.address, []).append(ref)
+            batches = [(address, refs[n:n + batch_size]) for address, refs in refs_by_address.items() for n in range(0, len(refs), batch_size)]
+            list(executor.map(lambda batch: sample_batch(*batch), batches))
+            time.sleep(max(interval - (time.time() - started), 0))
+
+def rpm_batch_size(max_apdu):
+    """Number of presentValue reads that fit in one ReadPropertyMultiple response
+    """
+    return max(1, (max_apdu - RPM_HEADER_BYTES) // RPM_BYTES_PER_POINT)
+
+def read_present_values(address, refs):
+    """Read the present values of several objects of one BACnet device with
+    ReadPropertyMultiple, in batches that fit the APDUs of the device
+
+    The points are read one by one only from devices that do not support
+    ReadPropertyMultiple, the batches are halved for devices that cannot
+    segment the answer, and a device that does not answer fails the whole batch.
+    """
+    values = []
+    n = 0
+    while n < len(refs):
+        if address in rpm_unsupported:
+            return values + [read_present_value(address, ref) for ref in refs[n:]]
+        batch = refs[n:n + rpm_batch_sizes.get(address, len(refs))]
+        if len(batch) == 1:
+            values.append(read_present_value(address, batch[0]))
+            n += 1
+            continue
+        # BAC0 function to read several objects: bacnet.readMultiple('address object object_instance property ...')
+        request = " ".join("%s %s presentValue" % (ref.object_type, ref.object_instance) for ref in batch)
+        try:
+            batch_values = bacnet.readMultiple("%s %s" % (address, request))
+        except BAC0.core.io.IOExceptions.UnrecognizedService:
+            print("Device at %s does not support ReadPropertyMultiple, reading its points one by one" % address)
+            rpm_unsupported.add(address)
+            continue
+        except BAC0.core.io.IOExceptions.SegmentationNotSupported:
+            rpm_batch_sizes[address] = max(len(batch) // 2, 1)
+            print("Device at %s cannot segment its answers, reading up to %d points at a time" % (address, rpm_batch_sizes[address]))
+            continue
+        except BAC0.core.io.IOExceptions.UnknownObjectError:
+            # The device rejected the request for one of its objects, the others are still read
+            batch_values = [read_present_value(address, ref) for ref in batch]
+        if not isinstance(batch_values, list) or len(batch_values) != len(batch):
+            # BAC0 answers a request that timed out with a single empty value
+            raise BAC0.core.io.IOExceptions.NoResponseFromController("No answer from the device at %s" % address)
+        values.extend(batch_values)
+        n += len(batch)
+    return values
+
+def read_present_value(address, ref):
+    try:
+        return bacnet.read("%s %s %s presentValue" % (address, ref.object_type, ref.object_instance))
+    except BAC0.core.io.IOExceptions.UnknownObjectError:
+        print("Device at %s has no %s %s" % (address, ref.object_type, ref.object_instance))
+        return None
+
+def validate_points(items):
+    """Read the local values of a batch of queued points of one BACnet device
+    and record the validation results
+    """
+    address = items[0].ref.address
+    validated = []
+    local_values = []
+    to_read = []
+    for item in items:
+        if sample_store is not None:
+            # Compare with the local sample taken when the cloud value was published
+            cloud_time = parse_timestamp(item.timestamp)
+            sampled = sample_store.aligned(item.ref, cloud_time, align_mode == "interpolate") if cloud_time is not None else None
+            if sampled is not None:
+                validated.append(item)
+                local_values.append(sampled)
+                continue
+        cached = value_cache.get((address, item.ref.object_type, item.ref.object_instance)) if value_cache is not None else None
+        if cached is not None:
+            validated.append(item)
+            local_values.append(cached[1])
+        else:
+            to_read.append(item)
+
+    if to_read:
+        read_values = read_present_values(address, [item.ref for item in to_read])
+        for item, local_value in zip(to_read, read_values):
+            if value_cache is not None:
+                value_cache.put((address, item.ref.object_type, item.ref.object_instance), local_value)
+        validated.extend(to_read)
+        local_values.extend(read_values)
+
+    record_validations(validated, local_values)
+
+def record_validations(items, local_values):
+    """Compare a batch of cloud values with their local values and record the results
+    """
+    matches = comparison_rules.compare(
+        [item.cloud_value for item in items], local_values,
+        [item.ref.object_type for item in items], [item.device_id for item in items], [item.point_name for item in items])
+    read_time = time.time()
+    if result_sink is not None:
+        # In a shard worker the results are recorded by the coordinator process
+        result_sink.put(("record", (items, local_values, [bool(match) for match in matches], read_time)))
+    else:
+        record_site_results(items, local_values, matches, read_time)
+    for item, local_value, match in zip(items, local_values, matches):
+        print(20*"-")
+        print(item.device_id, item.point_name, local_value, item.cloud_value, "VALIDATED" if match else "DIFFERENT")
+
+def record_site_results(items, local_values, matches, read_time):
+    by_site = {}
+    for item, local_value, match in zip(items, local_values, matches):
+        site_results = by_site.setdefault(item.ref.site, ([], [], []))
+        site_results[0].append(item)
+        site_results[1].append(local_value)
+        site_results[2].append(match)
+    for site_name, (site_items, site_values, site_matches) in by_site.items():
+        sites[site_name].record(site_items, site_values, site_matches, read_time)
+
+# The latency histogram buckets grow by 5% from 1 ms, which keeps the percentiles
+# within 5% of the measured latencies, up to about 4 days in the last bucket
+LATENCY_BUCKET_GROWTH = 1.05
+LATENCY_BUCKETS = 400
+
+def latency_buckets(latencies):
+    milliseconds = np.maximum(np.asarray(latencies, dtype=float) * 1000, 1.0)
+    return np.minimum((np.log(milliseconds) / np.log(LATENCY_BUCKET_GROWTH)).astype(np.int64), LATENCY_BUCKETS - 1)
+
+def latency_percentiles(counts, percentiles=(50, 95, 99)):
+    """Return the latencies in seconds at the given percentiles of a histogram, NaN when empty"""
+    cumulative = np.cumsum(counts)
+    if cumulative[-1] == 0:
+        return [np.nan] * len(percentiles)
+    buckets = np.searchsorted(cumulative, np.array(percentiles) / 100 * cumulative[-1])
+    return list(LATENCY_BUCKET_GROWTH ** (buckets + 1) / 1000)
+
+class LatencyHistograms:
+    """Log-bucketed histograms of the publish lag (from the cloud timestamp to the
+    message being received) and of the read latency (from the message being
+    received to the local value being read) of each cloud device
+    """
+    def __init__(self):
+        self.publish = {}
+        self.read = {}
+        self.lock = threading.Lock()
+
+    def record(self, items, read_time):
+        received = np.array([item.received if item.received is not None else np.nan for item in items], dtype=float)
+        published = np.array([parse_timestamp(item.timestamp) or np.nan for item in items], dtype=float)
+        publish_buckets = latency_buckets(np.nan_to_num(received - published))
+        read_buckets = latency_buckets(np.nan_to_num(read_time - received))
+        with self.lock:
+            for item, publish_lag, publish_bucket, read_latency, read_bucket in zip(
+                    items, received - published, publish_buckets, read_time - received, read_buckets):
+                if not np.isnan(publish_lag):
+                    self.publish.setdefault(item.device_id, np.zeros(LATENCY_BUCKETS, dtype=np.int64))[publish_bucket] += 1
+                if not np.isnan(read_latency):
+                    self.read.setdefault(item.device_id, np.zeros(LATENCY_BUCKETS, dtype=np.int64))[read_bucket] += 1
+
+    def summary(self):
+        """Return a DataFrame with the count and p50/p95/p99 latencies in seconds of each device"""
+        rows = {}
+        empty = np.zeros(LATENCY_BUCKETS, dtype=np.int64)
+        with self.lock:
+            for device_id in sorted(set(self.publish) | set(self.read)):
+                publish, read = self.publish.get(device_id, empty), self.read.get(device_id, empty)
+                rows[device_id] = [int(read.sum())] + latency_percentiles(publish) + latency_percentiles(read)
+        summary = pd.DataFrame.from_dict(rows, orient="index", columns=[
+            "values", "publish_lag_p50", "publish_lag_p95", "publish_lag_p99", "read_latency_p50", "read_latency_p95", "read_latency_p99"])
+        summary.index.name = "cloud_device_id"
+        return summary
+
+    def percentiles(self):
+        """Return the p50/p95/p99 publish lags and read latencies of all the devices"""
+        with self.lock:
+            publish = sum(self.publish.values(), np.zeros(LATENCY_BUCKETS, dtype=np.int64))
+            read = sum(self.read.values(), np.zeros(LATENCY_BUCKETS, dtype=np.int64))
+        return latency_percentiles(publish), latency_percentiles(read)
+
+    def stats(self):
+        publish, read = self.percentiles()
+        return "publish lag p50/p95/p99 %.2f/%.2f/%.2f s, read latency p50/p95/p99 %.2f/%.2f/%.2f s" % tuple(publish + read)
+
+class EventLog:
+    """Append-only JSONL log of the validation results, one line per compared value,
+    from which the results can be rebuilt if the program is killed between snapshots
+    """
+    def __init__(self, filename):
+        self.file = open(filename, "a")
+        self.lock = threading.Lock()
+
+    def append(self, items, local_values, matches):
+        lines = "".join(json.dumps({"time": time.time(), "sheet": item.ref.sheet, "row": item.ref.row,
+                                    "device_id": item.device_id, "point_name": item.point_name,
+                                    "cloud_value": item.cloud_value, "value": local_value,
+                                    "validation_status": "VALIDATED" if match else "DIFFERENT"}, default=str) + "\n"
+                        for item, local_value, match in zip(items, local_values, matches))
+        with self.lock:
+            self.file.write(lines)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def save_results(site):
+    """Write a consistent snapshot of the validation results of a site to its output file
+    """
+    with save_lock:
+        sheets = site.results.to_sheets(site.devices_points) if site.results is not None else dict(site.devices_points)
+        sheets["latency_summary"] = site.latencies.summary()
+        make_sheet(sheets, site.output)
+
+def checkpoint_results(interval):
+    """Save the validation results every interval seconds, off the message and reader threads
+    """
+    while True:
+        time.sleep(interval)
+        for site in list(sites.values()):
+            try:
+                save_results(site)
+            except Exception as error:
+                print("Could not save the checkpoint of the results of %s: %s" % (site.name, error))
+
+# Validation states of the mapped points
+PENDING, VALIDATED, DIFFERENT = 0, 1, 2
+STATUS_NAMES = np.array(["", "VALIDATED", "DIFFERENT"], dtype=object)
+
+class ResultStore:
+    """Validation results of the mapped points, shared by the reader threads
+
+    The latest cloud value, local value, state and number of cloud values seen
+    of every point are kept in arrays indexed by point. Each sheet (BACnet device)
+    has its own lock, so the readers of different devices record their results
+    at the same time, and the input sheets are only updated on a copy when the
+    results are saved.
+    """
+    def __init__(self, point_index):
+        self.refs = []
+        self.rows = {}
+        self.locks = {}
+        self.update(point_index)
+
+    def update(self, point_index):
+        """Map the store to a new point index, keeping the results of the points
+        whose local point and cloud point did not change
+        """
+        refs = [(key, ref) for key, refs in point_index.items() for ref in refs]
+        rows = {(ref.sheet, ref.row): row for row, (key, ref) in enumerate(refs)}
+        sheets = np.array([ref.sheet for key, ref in refs], dtype=object)
+        locks = [self.locks[sheet] for sheet in sorted(self.locks)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            kept, kept_from = [], []
+            for row, (key, ref) in enumerate(refs):
+                old_row = self.rows.get((ref.sheet, ref.row))
+                if old_row is not None and self.refs[old_row] == ref and (self.device_ids[old_row], self.point_names[old_row]) == key:
+                    kept.append(row)
+                    kept_from.append(old_row)
+            cloud_values = np.full(len(refs), None, dtype=object)
+            values = np.full(len(refs), None, dtype=object)
+            states = np.full(len(refs), PENDING, dtype=np.int8)
+            seen = np.zeros(len(refs), dtype=np.int32)
+            if kept:
+                cloud_values[kept], values[kept] = self.cloud_values[kept_from], self.values[kept_from]
+                states[kept], seen[kept] = self.states[kept_from], self.seen[kept_from]
+            self.refs = [ref for key, ref in refs]
+            self.rows = rows
+            self.sheets = sheets
+            self.labels = np.array([ref.row for key, ref in refs], dtype=object)
+            self.object_types = np.array([ref.object_type for key, ref in refs], dtype=object)
+            self.device_ids = np.array([key[0] for key, ref in refs], dtype=object)
+            self.point_names = np.array([key[1] for key, ref in refs], dtype=object)
+            self.cloud_values, self.values, self.states, self.seen = cloud_values, values, states, seen
+            self.locks = {sheet: self.locks.get(sheet) or threading.Lock() for sheet in set(sheets)}
+        finally:
+            for lock in locks:
+                lock.release()
+        return len(kept)
+
+    def record(self, items, local_values, matches):
+        by_sheet = {}
+        for item, local_value, match in zip(items, local_values, matches):
+            by_sheet.setdefault(item.ref.sheet, []).append((item, local_value, match))
+        for sheet, results in by_sheet.items():
+            if sheet not in self.locks:
+                continue
+            with self.locks[sheet]:
+                for item, local_value, match in results:
+                    row = self.rows.get((item.ref.sheet, item.ref.row))
+                    # Points queued before the input file was reloaded may no longer be mapped
+                    if (row is None or self.refs[row] != item.ref or self.device_ids[row] != item.device_id
+                            or self.point_names[row] != item.point_name):
+                        continue
+                    self.cloud_values[row] = item.cloud_value
+                    self.values[row] = local_value
+                    self.states[row] = VALIDATED if match else DIFFERENT
+                    self.seen[row] += 1
+
+    def checked(self):
+        return np.flatnonzero(self.states != PENDING)
+
+    def set_states(self, rows, matches):
+        states = np.where(matches, VALIDATED, DIFFERENT)
+        for sheet in set(self.sheets[rows]):
+            with self.locks[sheet]:
+                in_sheet = self.sheets[rows] == sheet
+                self.states[rows[in_sheet]] = states[in_sheet]
+
+    def to_sheets(self, devices_points):
+        """Return a copy of the input sheets with the cloud value, local value
+        and validation status of the checked points
+        """
+        sheets = {}
+        for sheet_name, device_points in devices_points.items():
+            sheets[sheet_name] = device_points.copy()
+            if sheet_name not in self.locks:
+                continue
+            with self.locks[sheet_name]:
+                rows = np.flatnonzero((self.sheets == sheet_name) & (self.states != PENDING))
+                cloud_values, values, statuses = self.cloud_values[rows], self.values[rows], STATUS_NAMES[self.states[rows]]
+            if len(rows):
+                labels = list(self.labels[rows])
+                for column in ("cloud_value", "value", "validation_status"):
+                    if column not in sheets[sheet_name].columns:
+                        sheets[sheet_name][column] = pd.Series(np.nan, index=sheets[sheet_name].index, dtype=object)
+                sheets[sheet_name].loc[labels, "cloud_value"] = cloud_values
+                sheets[sheet_name].loc[labels, "value"] = values
+                sheets[sheet_name].loc[labels, "validation_status"] = statuses
+        return sheets
+
+class CoverageTracker:
+    """Coverage target of a validation session
+
+    The reached event is set once every point of the result store has been seen
+    min_seen times or the target fraction of the points has been validated,
+    whichever of the set criteria comes first, and cleared when the target is
+    no longer met, for example after points were added by a reload of the input file.
+    """
+    def __init__(self, results, min_seen=0, target=0.0):
+        self.results = results
+        self.min_seen = min_seen
+        self.target = target
+        self.reached = threading.Event()
+
+    def check(self):
+        if self.target_met():
+            self.reached.set()
+        else:
+            self.reached.clear()
+
+    def target_met(self):
+        states, seen = self.results.states, self.results.seen
+        if len(states) == 0:
+            return False
+        if self.min_seen > 0 and seen.min() >= self.min_seen:
+            return True
+        return self.target > 0 and np.count_nonzero(states == VALIDATED) >= self.target * len(states)
+
+    def stats(self):
+        counts = np.bincount(self.results.states, minlength=3)
+        least_seen = int(self.results.seen.min()) if len(self.results.seen) else 0
+        return "%d validated, %d different, %d pending point(s), each seen at least %d time(s)" % (
+            counts[VALIDATED], counts[DIFFERENT], counts[PENDING], least_seen)
+
+# Values of binary and multistate points that are compared as numbers
+DEFAULT_STATES = {"active": 1, "inactive": 0, "true": 1, "false": 0, "on": 1, "off": 0}
+# Tolerances used when no rule applies, absorbing float rounding between BACnet and JSON
+DEFAULT_RULE = {"abs_tol": 1e-6, "rel_tol": 1e-6, "scale": 1.0, "offset": 0.0}
+
+class ComparisonRules:
+    """Rules used to decide whether a cloud value matches the local value
+
+    Rules are read from a JSON file with optional "types" (by BACnet object type,
+    e.g. "analogInput") and "points" (by "cloud_device_id/cloud_point_name") sections,
+    each rule setting abs_tol, rel_tol, scale and offset, and a "states" section
+    mapping state names to numbers. The local value is scaled (local * scale + offset)
+    before being compared with the cloud value. Values are compared as numbers when
+    both convert to numbers (directly or through the states) and as text otherwise.
+    """
+    def __init__(self, rules=None):
+        rules = rules or {}
+        self.types = rules.get("types", {})
+        self.points = rules.get("points", {})
+        self.states = dict(DEFAULT_STATES, **{str(k).lower(): v for k, v in rules.get("states", {}).items()})
+
+    @classmethod
+    def from_file(cls, rules_file):
+        with open(rules_file) as f:
+            return cls(json.load(f))
+
+    def parameters(self, object_types, device_ids, point_names):
+        """Return the abs_tol, rel_tol, scale and offset arrays for a batch of points
+        """
+        object_types = pd.Series(object_types, dtype=object)
+        point_keys = pd.Series(device_ids, dtype=object).astype(str) + "/" + pd.Series(point_names, dtype=object).astype(str)
+        columns = {}
+        for name, default in DEFAULT_RULE.items():
+            # Point rules take precedence over object type rules
+            column = np.full(len(object_types), default, dtype=float)
+            by_type = {key: rule[name] for key, rule in self.types.items() if name in rule}
+            if by_type:
+                column = object_types.map(by_type).fillna(pd.Series(column)).to_numpy(dtype=float)
+            by_point = {key: rule[name] for key, rule in self.points.items() if name in rule}
+            if by_point:
+                column = point_keys.map(by_point).fillna(pd.Series(column)).to_numpy(dtype=float)
+            columns[name] = column
+        return columns["abs_tol"], columns["rel_tol"], columns["scale"], columns["offset"]
+
+    def to_numbers(self, values):
+        """Return the values as floats (NaN when not numeric) and, for the values
+        that are not plain numbers, as normalized text
+        """
+        values = pd.Series(values, dtype=object)
+        numbers = np.array(pd.to_numeric(values, errors="coerce"), dtype=float)
+        text = np.full(len(values), None, dtype=object)
+        not_numbers = np.isnan(numbers)
+        if not_numbers.any():
+            states = values[not_numbers].astype(str).str.strip().str.lower()
+            numbers[not_numbers] = states.map(self.states).to_numpy(dtype=float, na_value=np.nan)
+            text[not_numbers] = states.to_numpy()
+        return numbers, text
+
+    def compare(self, cloud_values, local_values, object_types, device_ids, point_names):
+        """Compare a batch of cloud values with their local values in one vectorized step
+        and return an array of booleans, True where they match
+        """
+        if len(cloud_values) == 0:
+            return np.zeros(0, dtype=bool)
+        abs_tol, rel_tol, scale, offset = self.parameters(object_types, device_ids, point_names)
+        cloud_numbers, cloud_text = self.to_numbers(cloud_values)
+        local_numbers, local_text = self.to_numbers(local_values)
+        local_numbers = local_numbers * scale + offset
+        numeric = ~np.isnan(cloud_numbers) & ~np.isnan(local_numbers)
+        with np.errstate(invalid="ignore"):
+            close = np.abs(cloud_numbers - local_numbers) <= np.maximum(abs_tol, rel_tol * np.abs(local_numbers))
+        return np.where(numeric, close, cloud_text == local_text)
+
+def reevaluate_results():
+    """Compare again all the recorded cloud and local values with the current
+    rules, in one vectorized step for the whole result store
+    """
+    for site in sites.values():
+        results = site.results
+        rows = results.checked()
+        if len(rows) == 0:
+            continue
+        matches = comparison_rules.compare(
+            results.cloud_values[rows], results.values[rows], results.object_types[rows],
+            results.device_ids[rows], results.point_names[rows])
+        results.set_states(rows, matches)
+        site.coverage.check()
+        print("Validation results of %s re-evaluated for %d point(s)" % (site.name, len(rows)))
+
+def watch_rules(rules_file, interval):
+    """Reload the comparison rules when the rules file changes and re-evaluate the results
+    """
+    global comparison_rules
+    last_modified = os.path.getmtime(rules_file)
+    while True:
+        time.sleep(interval)
+        modified = os.path.getmtime(rules_file)
+        if modified != last_modified:
+            last_modified = modified
+            try:
+                comparison_rules = ComparisonRules.from_file(rules_file)
+            except (OSError, ValueError) as error:
+                print("Could not reload comparison rules from %s: %s" % (rules_file, error))
+                continue
+            print("Comparison rules reloaded from %s" % rules_file)
+            reevaluate_results()
 
 def print_message(message):
     body = message.data
@@ -117,67 +1036,745 @@ def print_message(message):
     # df.loc[df['column_name'] == some_value]
     
 
-def message_callback(message: pubsub_v1.subscriber.message.Message) -> None:
-    global devices, devices_points
-    
-    body = message.data
-    device_id = message.attributes['deviceId']
-    gateway_id = message.attributes['gatewayId']
-    sub_folder = message.attributes['subFolder']
-    type = message.attributes['subType']
-    timestamp = json.loads(body)['timestamp']
+def is_watched_pointset(attributes, site):
+    return (attributes.get('subFolder') == "pointset" and attributes.get('subType', "") == ""
+            and attributes.get('deviceId') in site.watched_devices)
 
-    if sub_folder == "pointset" and type == "":
-        points = json.loads(body)['points']
-        # print(dir(points))
-        for point in points.items():
-            point_name = point[0]
-            cloud_value = point[1]['present_value']
-            
-            for device in devices_points:
-                device_points = devices_points[device]
-                match = device_points.loc[device_points['cloud_point_name'] == point_name]
-                if len(match)>0 and device_id==match['cloud_device_id'].values[0] and point_name==match['cloud_point_name'].values[0]:
-                    # print(match)
-                    local_point_name = match.iloc[0].name
-                    # print(local_point_name)
-                    # BAC0 function to read point: bacnet.read('address object object_instance property')
-                    # where address is the BACnet device IP address
-                    address = devices[device][2]
-                    object = match['object'].values[0].split(":")[0]
-                    object_instance = match['object'].values[0].split(":")[1]
-                    property = "presentValue"
-                    local_value = bacnet.read("%s %s %s %s" % (address, object, object_instance, property))
-                    devices_points[device].at[local_point_name, 'cloud_value'] = cloud_value
-                    devices_points[device].at[local_point_name, 'value'] = local_value
-                    validation_status = ""
-                    if cloud_value == local_value:
-                        validation_status = "VALIDATED"
-                    else:
-                        validation_status = "DIFFERENT"
-                    devices_points[device].at[local_point_name, 'validation_status'] = validation_status
-                    print(20*"-")
-                    print(device_id, point_name, local_value, cloud_value, validation_status)
-                    # print(devices_points[device])
-                    # print(tabulate(d  evices_points[device], headers='keys', tablefmt='psql'))
-                    
+def queued_message_decoded(site, queue_id, count):
+    """Tell the durable queue of the site how many points of one of its messages are waiting to be recorded"""
+    if queue_id is None:
+        return
+    if result_sink is not None:
+        # In a shard worker the durable queue is kept by the coordinator process
+        result_sink.put(("decoded", (site.name, queue_id, count)))
+    else:
+        site.durable_queue.decoded(queue_id, count)
+
+def message_callback(message: pubsub_v1.subscriber.message.Message, site) -> None:
+    global reader_pool
+
+    # Messages are filtered on their attributes, so only the pointset events of
+    # the watched devices have their payload decoded
+    device_id = message.attributes.get('deviceId')
+    queue_id = getattr(message, "queue_id", None)
+    if not is_watched_pointset(message.attributes, site):
+        queued_message_decoded(site, queue_id, 0)
+        message.ack()
+        return
+
+    if shard_router is not None:
+        # The payload is decoded by the worker process owning the device
+        shard_router.put(message, site)
+        message.ack()
+        return
+
+    received = getattr(message, "received", None) or time.time()
+    queue_ids = (queue_id,) if queue_id is not None else ()
+    body = json.loads(message.data)
+    timestamp = body['timestamp']
+    items = []
+    for point_name, point in body['points'].items():
+        cloud_value = point['present_value']
+        for ref in site.point_index.get((device_id, point_name), []):
+            items.append(ValidationItem(ref, device_id, point_name, cloud_value, timestamp, received, queue_ids))
+
+    # A queued message is kept until its points are recorded
+    queued_message_decoded(site, queue_id, len(items))
+    # The BACnet reads are done by the reader pool, so the message can be acknowledged straight away
+    reader_pool.put_many(items)
     message.ack()
 
-devices = {}
-devices_points = {}
+# Maximum length in bytes of a Pub/Sub subscription filter
+FILTER_MAX_LENGTH = 256
+
+def subscription_filter(device_ids):
+    """Return the Pub/Sub filter matching the pointset events of the watched devices,
+    or of all the devices when the device list does not fit in a filter
+    """
+    # A missing subType attribute is accepted like an empty one, as is_watched_pointset does
+    pointset = 'attributes.subFolder = "pointset" AND (attributes.subType = "" OR NOT attributes:subType)'
+    devices = " OR ".join('attributes.deviceId = "%s"' % device_id for device_id in sorted(device_ids))
+    filter = "%s AND (%s)" % (pointset, devices)
+    if not device_ids or len(filter.encode("utf-8")) > FILTER_MAX_LENGTH:
+        return pointset
+    return filter
+
+def create_filtered_subscription(subscriber, project_id, subscription_id, filtered_id, device_ids):
+    """Create a subscription to the topic of subscription_id that only receives
+    the messages validated by the tool, and return its path
+    """
+    subscription_path = subscriber.subscription_path(project_id, subscription_id)
+    filtered_path = subscriber.subscription_path(project_id, filtered_id)
+    filter = subscription_filter(device_ids)
+    topic = subscriber.get_subscription(request={"subscription": subscription_path}).topic
+    try:
+        subscriber.create_subscription(request={"name": filtered_path, "topic": topic, "filter": filter})
+        print("Created subscription %s with filter: %s" % (filtered_path, filter))
+    except AlreadyExists:
+        existing = subscriber.get_subscription(request={"subscription": filtered_path}).filter
+        if existing != filter:
+            print("Subscription %s already exists with a different filter: %s" % (filtered_path, existing))
+    return filtered_path
+
+class MessageRecorder:
+    """Save the received Pub/Sub messages to a JSONL file, one message per line,
+    before passing them on to the message callback
+    """
+    def __init__(self, filename, callback):
+        self.file = open(filename, "w")
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, message):
+        self.write([message])
+        self.callback(message)
+
+    def write(self, messages):
+        lines = []
+        for message in messages:
+            publish_time = message.publish_time.timestamp() if message.publish_time is not None else time.time()
+            lines.append(json.dumps({"data": message.data.decode("utf-8"), "attributes": dict(message.attributes),
+                                     "publish_time": publish_time}) + "\n")
+        with self.lock:
+            self.file.write("".join(lines))
+            self.file.flush()
+            self.count += len(lines)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        print("%d message(s) recorded" % self.count)
+
+# Time in seconds a synchronous pull waits for messages before returning empty
+PULL_TIMEOUT = 10
+# Maximum number of ack ids sent in one acknowledge request
+ACK_BATCH_SIZE = 1000
+
+def point_index_frame(point_index):
+    """Return the point index as a DataFrame, used to match whole batches of received points at once"""
+    keys = [(device_id, point_name, ref) for (device_id, point_name), refs in point_index.items() for ref in refs]
+    return pd.DataFrame(keys, columns=["device_id", "point_name", "ref"])
+
+def pointset_items(messages, point_frame, site):
+    """Decode a batch of Pub/Sub messages and match all their pointset values
+    with the point index in one merge, returning the items to validate
+    """
+    received_time = time.time()
+    received = []
+    for message in messages:
+        attributes = message.attributes
+        if not is_watched_pointset(attributes, site):
+            continue
+        device_id = attributes["deviceId"]
+        try:
+            payload = json.loads(message.data)
+            timestamp = payload.get("timestamp")
+            points = [(device_id, point_name, point.get("present_value"), timestamp)
+                      for point_name, point in payload.get("points", {}).items()]
+        except ValueError as error:
+            print("Could not decode message from %s: %s" % (device_id, error))
+            continue
+        except (AttributeError, TypeError) as error:
+            # The payload is valid JSON but not a pointset event
+            print("Unexpected pointset payload from %s: %s" % (device_id, error))
+            continue
+        received.extend(points)
+    if not received:
+        return []
+    received = pd.DataFrame(received, columns=["device_id", "point_name", "cloud_value", "timestamp"])
+    # An inner merge keeps the order of the messages, so the latest value of a point is queued last
+    matched = received.merge(point_frame, on=["device_id", "point_name"])
+    return [ValidationItem(*row, received_time) for row in zip(matched["ref"].tolist(), matched["device_id"].tolist(), matched["point_name"].tolist(),
+                                                                matched["cloud_value"].tolist(), matched["timestamp"].tolist())]
+
+def pull_messages(subscriber, subscription_path, batch_size, timeout, site, recorder=None):
+    """Receive the messages of a site with synchronous pulls of up to batch_size
+    messages, queue their points for validation (or store the messages in the
+    durable queue of the site) and acknowledge each batch in bulk, until timeout
+    seconds have passed or the coverage target of the site is reached
+    """
+    point_frame = point_index_frame(site.point_index)
+    index_version = site.index_version
+    stop = site.coverage.reached
+    queue = site.durable_queue
+    start = time.time()
+    count = 0
+    while time.time() - start < timeout and not stop.is_set():
+        try:
+            response = subscriber.pull(request={"subscription": subscription_path, "max_messages": batch_size},
+                                       timeout=min(PULL_TIMEOUT, max(timeout - (time.time() - start), 1)))
+        except DeadlineExceeded:
+            continue
+        if not response.received_messages:
+            continue
+        messages = [received.message for received in response.received_messages]
+        if recorder is not None:
+            recorder.write(messages)
+        if site.index_version != index_version:
+            point_frame = point_index_frame(site.point_index)
+            index_version = site.index_version
+        if queue is not None:
+            queue.put_many([message for message in messages if is_watched_pointset(message.attributes, site)])
+        elif shard_router is not None:
+            shard_router.put_many([message for message in messages if is_watched_pointset(message.attributes, site)], site)
+        else:
+            reader_pool.put_many(pointset_items(messages, point_frame, site))
+        ack_ids = [received.ack_id for received in response.received_messages]
+        for n in range(0, len(ack_ids), ACK_BATCH_SIZE):
+            subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": ack_ids[n:n + ACK_BATCH_SIZE]})
+        count += len(messages)
+    return count
+
+class DurableQueue:
+    """SQLite queue of the received messages
+
+    Messages are acknowledged as soon as they are stored, and a consumer thread
+    passes them on to consume in the order they arrived, so slow BACnet reads
+    never keep messages past their ack deadline. A message is deleted once
+    consume has reported its number of points with decoded and they have all
+    been recorded, so messages left in the queue by a previous run, including
+    those whose points could not be read, are consumed first.
+    """
+    def __init__(self, filename, consume, accept, batch_size=100):
+        self.connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                "data BLOB, attributes TEXT, publish_time REAL, received REAL)")
+        self.consume = consume
+        self.accept = accept
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        # Messages passed on to consume and not decoded yet, and the number of points still to record of the decoded ones
+        self.undecoded = set()
+        self.outstanding = {}
+        self.available = threading.Event()
+        self.available.set()
+        threading.Thread(target=self.run, name="queue-consumer", daemon=True).start()
+
+    def __call__(self, message):
+        if self.accept(message.attributes):
+            self.put_many([message])
+        message.ack()
+
+    def put_many(self, messages):
+        received = time.time()
+        rows = [(message.data, json.dumps(dict(message.attributes)),
+                 message.publish_time.timestamp() if message.publish_time is not None else received, received)
+                for message in messages]
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("INSERT INTO messages (data, attributes, publish_time, received) VALUES (?, ?, ?, ?)", rows)
+            self.connection.execute("COMMIT")
+        self.available.set()
+
+    def run(self):
+        last_id = 0
+        while True:
+            self.available.wait()
+            self.available.clear()
+            while True:
+                with self.lock:
+                    rows = self.connection.execute("SELECT id, data, attributes, publish_time, received FROM messages "
+                                                   "WHERE id > ? ORDER BY id LIMIT ?", (last_id, self.batch_size)).fetchall()
+                    self.undecoded.update(row[0] for row in rows)
+                if not rows:
+                    break
+                for message_id, data, attributes, publish_time, received in rows:
+                    try:
+                        self.consume(ReplayMessage({"data": data, "attributes": json.loads(attributes),
+                                                    "publish_time": publish_time, "received": received, "queue_id": message_id}))
+                    except Exception as error:
+                        print("Error validating queued message %d: %s" % (message_id, error))
+                        self.decoded(message_id, 0)
+                last_id = rows[-1][0]
+
+    def decoded(self, message_id, count):
+        """Record that count points of a consumed message are waiting to be recorded"""
+        with self.lock:
+            if message_id not in self.undecoded:
+                return
+            self.undecoded.discard(message_id)
+            if count > 0:
+                self.outstanding[message_id] = count
+            else:
+                self.connection.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    def recorded(self, message_ids):
+        """Record that one point of each of message_ids has been recorded, and delete the messages with no point left"""
+        finished = []
+        with self.lock:
+            for message_id in message_ids:
+                if message_id not in self.outstanding:
+                    continue
+                self.outstanding[message_id] -= 1
+                if self.outstanding[message_id] == 0:
+                    del self.outstanding[message_id]
+                    finished.append((message_id,))
+            if finished:
+                self.connection.executemany("DELETE FROM messages WHERE id = ?", finished)
+
+    def size(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+class ReplayMessage:
+    """Stand-in for a Pub/Sub message read back from a recorded file or the durable queue"""
+    def __init__(self, record):
+        data = record["data"]
+        self.data = data if isinstance(data, bytes) else data.encode("utf-8")
+        self.attributes = record["attributes"]
+        self.publish_time = datetime.fromtimestamp(record["publish_time"])
+        self.received = record.get("received")
+        self.queue_id = record.get("queue_id")
+        self.acked = False
+
+    def ack(self):
+        self.acked = True
+
+    def nack(self):
+        self.acked = False
+
+def replay_messages(filename, callback, timing="fast", timeout=None, stop=None):
+    """Feed the messages recorded in filename to callback, as fast as possible
+    or keeping the original time between them, until the stop event is set,
+    and return how many were replayed
+    """
+    start = time.time()
+    first_publish_time = None
+    count = 0
+    with open(filename) as replay_file:
+        for line in replay_file:
+            if line.strip() == "":
+                continue
+            record = json.loads(line)
+            if timing == "original":
+                if first_publish_time is None:
+                    first_publish_time = record["publish_time"]
+                delay = record["publish_time"] - first_publish_time - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if timeout is not None and time.time() - start > timeout:
+                break
+            if stop is not None and stop.is_set():
+                break
+            try:
+                callback(ReplayMessage(record))
+            except Exception as e:
+                print("Error replaying message %d: %s" % (count + 1, e))
+            count += 1
+    return count
+
+# Number of recent mismatches of each site served by the HTTP API
+MISMATCH_HISTORY = 200
+
+class Site:
+    """A building validated in the session, with its Pub/Sub subscription,
+    input and output files, point mapping and validation results
+    """
+    def __init__(self, name, project="", subscription="", input="input.xlsx", output="output.xlsx",
+                 filtered_subscription="", queue="", record=""):
+        self.name = name
+        self.project = project
+        self.subscription = subscription
+        self.input = input
+        self.output = output
+        self.filtered_subscription = filtered_subscription
+        self.queue_file = queue
+        self.record_file = record
+        self.devices = {}
+        self.devices_points = {}
+        self.point_index = {}
+        self.watched_devices = set()
+        self.results = None
+        self.coverage = None
+        self.event_log = None
+        self.durable_queue = None
+        self.latencies = LatencyHistograms()
+        self.sheet_digests = {}
+        self.index_version = 0
+        self.mismatches = deque(maxlen=MISMATCH_HISTORY)
+        self.shard = None
+
+    def record(self, items, local_values, matches, read_time):
+        self.results.record(items, local_values, matches)
+        if self.durable_queue is not None:
+            self.durable_queue.recorded(queue_id for item in items for queue_id in item.queue_ids)
+        self.latencies.record(items, read_time)
+        self.coverage.check()
+        if self.event_log is not None:
+            self.event_log.append(items, local_values, matches)
+        self.mismatches.extend({"time": read_time, "device_id": item.device_id, "point_name": item.point_name,
+                                "cloud_value": item.cloud_value, "value": local_value, "sheet": item.ref.sheet}
+                               for item, local_value, match in zip(items, local_values, matches) if not match)
+
+    def stats(self):
+        stats = [self.coverage.stats(), self.latencies.stats()]
+        if self.durable_queue is not None:
+            stats.append("%d message(s) in the durable queue" % self.durable_queue.size())
+        return ", ".join(stats)
+
+    def close(self):
+        save_results(self)
+        if self.event_log is not None:
+            self.event_log.close()
+
+def load_sites(args):
+    """Return the sites to validate, read from the JSON sites file, a list of
+    objects with the Site parameters, or from the command line options
+    """
+    if args.sites == "":
+        return [Site("site", args.project, args.sub, args.input, args.output, args.filtered_sub, args.queue, args.record)]
+    with open(args.sites) as sites_file:
+        return [Site(**config) for config in json.load(sites_file)]
+
+def discovered_devices():
+    """Run the global BACnet discovery the first time it is needed and return the devices found, by name
+    """
+    global discovered
+    if discovered is None:
+        bacnet.discover(global_broadcast=True)
+        discovered = {device[0]: device for device in bacnet.devices}
+    return discovered
+
+def site_point_index(site, sheets):
+    """Return the point index of the sheets of a site, limited to the devices of its shard in a shard worker
+    """
+    point_index = build_point_index(sheets, site.devices, site.name)
+    if site.shard is None:
+        return point_index
+    shard, shards = site.shard
+    return {key: refs for key, refs in point_index.items() if shard_of(key[0], shards) == shard}
+
+def setup_site(site, args, devices=None):
+    """Load the input file of a site, find its BACnet devices (unless they are given)
+    and build its point mapping and result store
+    """
+    if exists(site.input):
+        site.devices_points.update(load_sheets(site.input, None if args.no_cache else site.input + ".cache"))
+        site.sheet_digests = sheet_digests(site.input) or {}
+        print("%d sheets loaded from %s" % (len(site.devices_points), site.input))
+        if args.verbose:
+            for sheet_name, device_points in site.devices_points.items():
+                print(sheet_name)
+                print(tabulate(device_points, headers='keys', tablefmt='psql'))
+
+    if devices is not None:
+        site.devices.update(devices)
+    elif args.seed_devices and "devices_list" in site.devices_points:
+        # The device addresses come from the input file, only the missing or stale ones are looked up
+        site.devices.update(check_seeded_devices(seed_devices(site.devices_points["devices_list"], site.devices_points.keys())))
+        print("%d device(s) seeded from the devices_list sheet of %s" % (len(site.devices), site.input))
+    else:
+        if args.seed_devices:
+            print("No devices_list sheet in %s, discovering the devices" % site.input)
+        site.devices.update(discovered_devices())
+
+    site.point_index = site_point_index(site, site.devices_points)
+    print("%d cloud points of %s mapped to local points" % (len(site.point_index), site.name))
+    site.watched_devices = set(device_id for device_id, point_name in site.point_index)
+
+    site.results = ResultStore(site.point_index)
+    site.coverage = CoverageTracker(site.results, int(args.stop_seen), float(args.stop_coverage) / 100)
+    if int(args.checkpoint_interval) > 0:
+        site.event_log = EventLog(os.path.splitext(site.output)[0] + "_events.jsonl")
+
+def reload_site(site):
+    """Parse again the sheets of the input file of a site that changed and update
+    its point index in place, keeping the results of the rows whose mapping did not change
+    """
+    digests = sheet_digests(site.input)
+    if digests is None:
+        sheet_names = pd.ExcelFile(site.input).sheet_names
+        changed = sheet_names
+    else:
+        sheet_names = list(digests)
+        changed = [sheet_name for sheet_name, digest in digests.items() if site.sheet_digests.get(sheet_name) != digest]
+    sheets = pd.read_excel(site.input, sheet_name=changed, dtype=str, header=[0], index_col=[0]) if changed else {}
+    sheets = {sheet_name: clean_sheet(dataframe) for sheet_name, dataframe in sheets.items()}
+    # The parsed sheets are compared with the loaded ones, as a file without sheet
+    # digests, or strings renumbered in the shared strings, mark sheets as changed
+    sheets = {sheet_name: dataframe for sheet_name, dataframe in sheets.items()
+              if sheet_name not in site.devices_points or not dataframe.equals(site.devices_points[sheet_name])}
+    removed = [sheet_name for sheet_name in site.devices_points if sheet_name not in sheet_names]
+    site.sheet_digests = digests or {}
+    if not sheets and not removed:
+        return
+
+    reloaded = set(sheets) | set(removed)
+    point_index = {key: [ref for ref in refs if ref.sheet not in reloaded] for key, refs in site.point_index.items()}
+    for key, refs in site_point_index(site, sheets).items():
+        point_index.setdefault(key, []).extend(refs)
+    point_index = {key: refs for key, refs in point_index.items() if refs}
+    # The index is updated in place, as the message callbacks keep reading it
+    for key in [key for key in site.point_index if key not in point_index]:
+        del site.point_index[key]
+    site.point_index.update(point_index)
+    site.watched_devices = set(device_id for device_id, point_name in point_index)
+    site.index_version += 1
+    # The sheets and the results are swapped together, so a save never writes the results on the wrong sheets
+    with save_lock:
+        for sheet_name in removed:
+            del site.devices_points[sheet_name]
+        site.devices_points.update(sheets)
+        kept = site.results.update(site.point_index)
+    site.coverage.check()
+    if sample_store is not None:
+        sample_store.add_refs(ref for refs in point_index.values() for ref in refs)
+    print("%d sheet(s) of %s reloaded, %d cloud points mapped, %d kept their results" % (
+        len(reloaded), site.input, len(point_index), kept))
+
+def watch_input(site, interval):
+    """Reload the changed sheets of the input file of a site when the file is saved
+    """
+    last_modified = os.path.getmtime(site.input)
+    while True:
+        time.sleep(interval)
+        try:
+            modified = os.path.getmtime(site.input)
+        except OSError:
+            continue
+        if modified != last_modified:
+            try:
+                reload_site(site)
+                last_modified = modified
+            except Exception as error:
+                # The file may still be being written, it is read again at the next check
+                print("Could not reload %s: %s" % (site.input, error))
+
+def start_validation(args, read_points=True):
+    """Start the comparison rules, reader pool, sampler, value cache and input
+    watchers shared by the sites; the coordinator of shard workers reads no points
+    """
+    global reader_pool, value_cache, sample_store, align_mode, comparison_rules
+    if args.rules != "":
+        comparison_rules = ComparisonRules.from_file(args.rules)
+        threading.Thread(target=watch_rules, args=(args.rules, 5), name="rules-watcher", daemon=True).start()
+
+    if read_points and float(args.sample_interval) > 0:
+        align_mode = args.align
+        sample_store = SampleStore([ref for site in sites.values() for refs in site.point_index.values() for ref in refs],
+                                   int(args.sample_size), max_distance=float(args.sample_interval))
+        threading.Thread(target=sample_points, args=(float(args.sample_interval), int(args.readers), rpm_batch_size(int(args.max_apdu))),
+                         name="bacnet-sampler", daemon=True).start()
+        print("Sampling %d local points every %s seconds" % (len(sample_store.rows), args.sample_interval))
+
+    if read_points and float(args.cache_ttl) > 0:
+        value_cache = ValueCache(float(args.cache_ttl), int(args.cache_size))
+    reader_pool = ReaderPool(int(args.readers) if read_points else 0, validate_points, coalesce=float(args.coalesce) / 1000,
+                             batch_size=rpm_batch_size(int(args.max_apdu)))
+
+    if int(args.reload_interval) > 0:
+        for site in sites.values():
+            if exists(site.input):
+                threading.Thread(target=watch_input, args=(site, int(args.reload_interval)), name="input-watcher-%s" % site.name,
+                                 daemon=True).start()
+
+# Time in seconds a shard worker is given to read the points still queued when the session ends
+SHARD_DRAIN_TIMEOUT = 60
+
+def shard_of(device_id, shards):
+    """Return the shard of a cloud device, from a hash of its id that is the same in every process
+    """
+    return zlib.crc32(device_id.encode("utf-8")) % shards
+
+class ShardRouter:
+    """Routes the messages of the watched devices to the shard worker processes
+
+    The shard is a stable hash of the deviceId, so a worker always receives the
+    messages of the same devices, whose points and BACnet devices it owns.
+    """
+    def __init__(self, queues):
+        self.queues = queues
+
+    def put(self, message, site):
+        self.put_many([message], site)
+
+    def put_many(self, messages, site):
+        received = time.time()
+        batches = {}
+        for message in messages:
+            shard = shard_of(message.attributes.get("deviceId", ""), len(self.queues))
+            batches.setdefault(shard, []).append((
+                site.name, bytes(message.data), dict(message.attributes),
+                message.publish_time.timestamp() if message.publish_time is not None else received,
+                getattr(message, "received", None) or received, getattr(message, "queue_id", None)))
+        for shard, batch in batches.items():
+            self.queues[shard].put(batch)
+
+    def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+
+def shard_worker(shard, shards, args, site_devices, messages, results):
+    """Validate the points of the cloud devices of one shard with a BACnet stack
+    of its own, and send the results to the coordinator process
+    """
+    global bacnet, result_sink
+    # The coordinator handles Ctrl-C and saves the results
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    BAC0.log_level("silence")
+    # Only the coordinator discovers devices, the workers read their points by unicast from their own port
+    bacnet = BAC0.lite(ip=args.address or None, port=int(args.shard_port) + shard)
+    result_sink = results
+    for site in load_sites(args):
+        site.shard = (shard, shards)
+        setup_site(site, args, site_devices[site.name])
+        sites[site.name] = site
+    start_validation(args)
+
+    while True:
+        batch = messages.get()
+        if batch is None:
+            break
+        for site_name, data, attributes, publish_time, received, queue_id in batch:
+            message_callback(ReplayMessage({"data": data, "attributes": attributes, "publish_time": publish_time,
+                                            "received": received, "queue_id": queue_id}), sites[site_name])
+    reader_pool.wait_idle(SHARD_DRAIN_TIMEOUT)
+    reader_pool.stop()
+    results.put(None)
+    bacnet.disconnect()
+
+def merge_shard_results(results, shards):
+    """Record the results sent by the shard workers in the sites, until every worker has finished
+    """
+    finished = 0
+    while finished < shards:
+        batch = results.get()
+        if batch is None:
+            finished += 1
+        elif batch[0] == "decoded":
+            site_name, queue_id, count = batch[1]
+            sites[site_name].durable_queue.decoded(queue_id, count)
+        else:
+            record_site_results(*batch[1])
+
+def start_shards(args, shards):
+    """Start the shard worker processes and the thread merging their results,
+    and route the received messages to them; return the workers and the merging thread
+    """
+    global shard_router
+    # Forking a process running the BACnet stack threads is not safe, the workers are spawned
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    queues = [context.Queue() for shard in range(shards)]
+    worker_args = argparse.Namespace(**dict(vars(args), verbose=False, checkpoint_interval="0", http_port="0", stats_interval="0"))
+    site_devices = {site.name: site.devices for site in sites.values()}
+    workers = [context.Process(target=shard_worker, args=(shard, shards, worker_args, site_devices, queues[shard], results),
+                               name="shard-%d" % shard, daemon=True) for shard in range(shards)]
+    for worker in workers:
+        worker.start()
+    merger = threading.Thread(target=merge_shard_results, args=(results, shards), name="shard-merger", daemon=True)
+    merger.start()
+    shard_router = ShardRouter(queues)
+    print("Validating with %d shard worker processes on BACnet ports %d to %d" % (
+        shards, int(args.shard_port), int(args.shard_port) + shards - 1))
+    return workers, merger
+
+def stop_shards(workers, merger, timeout):
+    """Let the shard workers read the points they have queued and wait for their last results
+    """
+    shard_router.stop()
+    merger.join(timeout)
+    for worker in workers:
+        worker.join(1)
+        if worker.is_alive():
+            worker.terminate()
+
+def site_status(site):
+    results = site.results
+    counts = np.bincount(results.states, minlength=3)
+    # Percentiles without measurements are NaN, which is not valid JSON
+    publish, read = [[None if np.isnan(value) else value for value in values] for values in site.latencies.percentiles()]
+    return {"site": site.name, "points": int(len(results.states)), "validated": int(counts[VALIDATED]),
+            "different": int(counts[DIFFERENT]), "pending": int(counts[PENDING]),
+            "least_seen": int(results.seen.min()) if len(results.seen) else 0, "coverage_reached": site.coverage.reached.is_set(),
+            "publish_lag": dict(zip(("p50", "p95", "p99"), publish)), "read_latency": dict(zip(("p50", "p95", "p99"), read))}
+
+def devices_status(site):
+    results = site.results
+    counts = pd.crosstab(pd.Series(results.device_ids, name="device_id"),
+                         pd.Series(STATUS_NAMES[results.states], name="state")) if len(results.states) else pd.DataFrame()
+    return {device_id: {"validated": int(row.get("VALIDATED", 0)), "different": int(row.get("DIFFERENT", 0)),
+                        "pending": int(row.get("", 0))} for device_id, row in counts.iterrows()}
+
+def points_status(site, device_id):
+    results = site.results
+    rows = np.flatnonzero(results.device_ids == device_id)
+    return [{"point_name": results.point_names[row], "sheet": results.sheets[row], "row": results.labels[row],
+             "object_type": results.object_types[row], "status": STATUS_NAMES[results.states[row]],
+             "cloud_value": results.cloud_values[row], "value": results.values[row], "seen": int(results.seen[row])}
+            for row in rows]
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    """JSON API over the in-memory results of the sites
+
+    GET /status, /devices, /devices/DEVICE_ID and /mismatches?limit=N, each
+    accepting ?site=NAME to restrict the answer to one site. The results are
+    read without taking the result store locks, so the API never holds up the readers.
+    """
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        selected = [site for name, site in list(sites.items()) if name in query.get("site", [name])]
+        path = [unquote(part) for part in url.path.strip("/").split("/") if part != ""]
+        if path == ["status"]:
+            body = {"reader_queue": reader_pool.pending() if reader_pool is not None else 0,
+                    "sites": [site_status(site) for site in selected]}
+        elif path == ["devices"]:
+            body = {site.name: devices_status(site) for site in selected}
+        elif len(path) == 2 and path[0] == "devices":
+            body = {site.name: points_status(site, path[1]) for site in selected}
+        elif path == ["mismatches"]:
+            try:
+                limit = max(int(query.get("limit", [MISMATCH_HISTORY])[0]), 0)
+            except ValueError:
+                self.send_json(400, {"error": "limit must be an integer"})
+                return
+            body = {site.name: list(site.mismatches)[::-1][:limit] for site in selected}
+        else:
+            self.send_json(404, {"error": "unknown path %s" % url.path})
+            return
+        self.send_json(200, body)
+
+    def send_json(self, status, body):
+        content = json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+sites = {}
+discovered = None
+reader_pool = None
+rpm_unsupported = set()
+rpm_batch_sizes = {}
+value_cache = None
+sample_store = None
+align_mode = "nearest"
+comparison_rules = ComparisonRules()
+save_lock = threading.RLock()
 default_handler = None
 bacnet = None
-OUTPUT_SHEET_FILENAME = ""
+shard_router = None
+result_sink = None
 
 def sigint_handler(num, frame):    
-    global devices_points, OUTPUT_SHEET_FILENAME
-    print("Closing program and saving %s file." % OUTPUT_SHEET_FILENAME)
-    make_sheet(devices_points, OUTPUT_SHEET_FILENAME)
+    print("Closing program and saving %s file(s)." % ", ".join(site.output for site in sites.values()))
+    if reader_pool is not None:
+        print_stats()
+    for site in sites.values():
+        save_results(site)
 
     return default_handler(num, frame) 
 
 def main():
-    global bacnet, devices, devices_points, default_handler, OUTPUT_SHEET_FILENAME
+    global bacnet, default_handler
     show_title()
 
     default_handler = signal.getsignal(signal.SIGINT)
@@ -191,11 +1788,72 @@ def main():
     # parser.add_argument("-l", "--lite", action="store_true", default=False, help="run BAC0 in lite mode")
     parser.add_argument("-p", "--project", default="", help="GCP project id (required)")
     parser.add_argument("-s", "--sub", default="", help="GCP PubSub subscription (required)")
+    parser.add_argument("--sites", default="", help="JSON file with the list of sites to validate at the same time, each with its \
+                        name, project, subscription, input and output files and optional filtered_subscription, queue \
+                        and record, sharing the BACnet readers (optional, replaces -p, -s, -i and -o)")
     parser.add_argument("-i", "--input", default="input.xlsx", help="input file containing the point list (optional, \
                         the default is input.xlsx, accepted extensions are .xlsx and .ods)")
+    parser.add_argument("--reload-interval", default="5", help="time interval in seconds between the checks for changes to the \
+                        input file, the changed sheets are reloaded keeping the results of the unchanged points \
+                        (optional, default=5, 0 to disable)")
+    parser.add_argument("--no-cache", action="store_true", default=False, help="do not use or write the INPUT.cache file that \
+                        keeps the parsed input sheets for the next runs (optional)")
     parser.add_argument("-o", "--output",  default="output.xlsx", help="sheet file name for output results (optional, \
                         the default is output.xlsx, accepted extensions are .xlsx and .ods)")
     parser.add_argument("-a", "--address", default="", help="IP address of BACnet interface (optional)")
+    parser.add_argument("--seed-devices", action="store_true", default=False, help="take the BACnet device addresses from the \
+                        devices_list sheet of the input file instead of a global discovery, only the devices that do not \
+                        answer at their address are looked up with a targeted Who-Is (optional)")
+    parser.add_argument("-r", "--readers", default="4", help="number of BACnet reader threads validating the received points (optional, \
+                        default=4)")
+    parser.add_argument("--shards", default="0", help="number of worker processes validating the points, each owning the cloud \
+                        devices whose deviceId hashes to it and reading their BACnet points, for very large gateways \
+                        (optional, default=0, no worker processes)")
+    parser.add_argument("--shard-port", default="47809", help="UDP port of the BACnet stack of the first shard worker, the \
+                        next workers use the following ports (optional, default=47809)")
+    parser.add_argument("--coalesce", default="100", help="time in milliseconds to wait for more points of the same BACnet device \
+                        before reading them together (optional, default=100)")
+    parser.add_argument("--max-apdu", default="1476", help="maximum APDU size in bytes accepted by the BACnet devices, used to split \
+                        ReadPropertyMultiple requests (optional, default=1476)")
+    parser.add_argument("--cache-ttl", default="0", help="time in seconds for which a value read from a BACnet point is reused \
+                        for the cloud values received for it (optional, default=0, no caching)")
+    parser.add_argument("--cache-size", default="100000", help="maximum number of BACnet point values kept in the cache, the least \
+                        recently used are evicted first (optional, default=100000)")
+    parser.add_argument("--sample-interval", default="0", help="time interval in seconds between background reads of all the mapped \
+                        points, cloud values are then compared with the local sample taken nearest their timestamp \
+                        (optional, default=0, no sampling)")
+    parser.add_argument("--sample-size", default="120", help="number of local samples kept for each point (optional, default=120)")
+    parser.add_argument("--align", default="nearest", choices=["nearest", "interpolate"], help="compare cloud values with the nearest \
+                        local sample or with the value interpolated at their timestamp (optional, default=nearest)")
+    parser.add_argument("--rules", default="", help="JSON file with the tolerance, state mapping and scaling rules used to compare \
+                        cloud and local values, reloaded when it changes (optional)")
+    parser.add_argument("--checkpoint-interval", default="300", help="time interval in seconds between the snapshots of the results \
+                        written to the output file, every result is also appended to OUTPUT_events.jsonl as it is recorded \
+                        (optional, default=300, 0 to disable)")
+    parser.add_argument("--http-port", default="0", help="port of the local HTTP API serving the validation status as JSON \
+                        on /status, /devices, /devices/DEVICE_ID and /mismatches (optional, default=0, disabled)")
+    parser.add_argument("--http-address", default="127.0.0.1", help="address the HTTP API listens on (optional, \
+                        default=127.0.0.1, only reachable from this computer)")
+    parser.add_argument("--stats-interval", default="60", help="time interval in seconds between the statistics lines printed \
+                        on the console (optional, default=60, 0 to disable)")
+    parser.add_argument("--stop-seen", default="0", help="stop and write the output file once a cloud value has been received \
+                        this many times for every mapped point (optional, default=0, disabled)")
+    parser.add_argument("--stop-coverage", default="0", help="stop and write the output file once this percentage of the mapped \
+                        points has been validated (optional, default=0, disabled)")
+    parser.add_argument("--filtered-sub", default="", help="name of a subscription to create on the topic of the subscription \
+                        with a filter that only lets through the pointset events of the devices in the input file, and to \
+                        receive the messages from (optional)")
+    parser.add_argument("--pull-batch", default="0", help="receive the messages with synchronous pulls of up to this many messages, \
+                        decoded and acknowledged together, instead of the streaming pull (optional, default=0, streaming pull)")
+    parser.add_argument("--queue", default="", help="SQLite file in which the received messages are stored before being \
+                        acknowledged, and validated from in the background, messages left from a previous run are \
+                        validated first (optional)")
+    parser.add_argument("--record", default="", help="JSONL file in which to save the received Pub/Sub messages, to be replayed \
+                        later with --replay (optional)")
+    parser.add_argument("--replay", default="", help="JSONL file of Pub/Sub messages saved with --record, validated instead of \
+                        the messages of the subscription, which is then not required (optional)")
+    parser.add_argument("--replay-timing", default="fast", choices=["original", "fast"], help="replay the saved messages with \
+                        their original timing or as fast as possible (optional, default=fast)")
     parser.add_argument("-t", "--timeout", default="3600", help="time interval in seconds for which to receive messages (optional, \
                         default=3600 seconds, equating to 1 hour)")
 
@@ -208,14 +1866,10 @@ def main():
     else:
         BAC0.log_level("silence")
 
-    if args.project!="" and args.sub!="" and args.input!="" and args.output!="":
-        PROJECT_ID = args.project
-        SUBSCRIPTION_ID = args.sub
-        POINTS_LIST_INPUT_FILE = args.input
+    if (args.replay!="" or args.sites!="" or (args.project!="" and args.sub!="")) and args.input!="" and args.output!="":
         BACNET_IP_ADDRESS = args.address
         # LITE_MODE = args.lite
         LITE_MODE = True
-        OUTPUT_SHEET_FILENAME = args.output
 
         if LITE_MODE:
             if BACNET_IP_ADDRESS != "":
@@ -228,42 +1882,116 @@ def main():
             else:
                 bacnet = BAC0.connect()
 
-        discover = bacnet.discover(global_broadcast=True)
+        # The BACnet stack, reader pool, cache and sampler are shared by all the sites
+        for site in load_sites(args):
+            setup_site(site, args)
+            sites[site.name] = site
 
-        for device in bacnet.devices:
-            devices[device[0]] = device
-
-        # print(devices)
-
-        if exists(POINTS_LIST_INPUT_FILE):
-            spreadsheet = pd.ExcelFile(POINTS_LIST_INPUT_FILE)
-            for sheet_name in spreadsheet.sheet_names:
-                print(sheet_name)
-                devices_points[sheet_name] = get_sheet_dict(POINTS_LIST_INPUT_FILE, sheet_name)
-                pprint(devices_points[sheet_name])
-                print(tabulate(devices_points[sheet_name], headers='keys', tablefmt='psql'))
+        # With shard workers, the points are read and compared in the worker processes
+        shards = int(args.shards)
+        start_validation(args, read_points=shards == 0)
+        if shards > 0:
+            workers, merger = start_shards(args, shards)
 
         # Number of seconds the subscriber should listen for messages
         TIMEOUT = int(args.timeout)
 
+        if int(args.checkpoint_interval) > 0:
+            threading.Thread(target=checkpoint_results, args=(int(args.checkpoint_interval),), name="checkpoint", daemon=True).start()
+
+        if int(args.http_port) > 0:
+            http_server = ThreadingHTTPServer((args.http_address, int(args.http_port)), StatusRequestHandler)
+            http_server.daemon_threads = True
+            threading.Thread(target=http_server.serve_forever, name="http-api", daemon=True).start()
+            print("Validation status served on http://%s:%s/status" % (args.http_address, args.http_port))
+
+        if int(args.stats_interval) > 0:
+            threading.Thread(target=report_stats, args=(int(args.stats_interval),), daemon=True).start()
+
+        if args.replay != "":
+            # The replayed messages are validated against the first site
+            site = next(iter(sites.values()))
+            print("Replaying messages from %s\n" % args.replay)
+            start_time = time.time()
+            count = replay_messages(args.replay, partial(message_callback, site=site), args.replay_timing, TIMEOUT, site.coverage.reached)
+            print("%d message(s) replayed, waiting for the BACnet reads" % count)
+            if shards > 0:
+                stop_shards(workers, merger, max(TIMEOUT - (time.time() - start_time), 0))
+            reader_pool.wait_idle(max(TIMEOUT - (time.time() - start_time), 0))
+            reader_pool.stop()
+            print_stats()
+            for site in sites.values():
+                site.close()
+            return
+
         subscriber = pubsub_v1.SubscriberClient()
-        # The `subscription_path` method creates a fully qualified identifier
-        # in the form `projects/{project_id}/subscriptions/{subscription_id}`
-        subscription_path = subscriber.subscription_path(PROJECT_ID, SUBSCRIPTION_ID)
+        callbacks = {}
+        subscription_paths = {}
+        for site in sites.values():
+            callback = partial(message_callback, site=site)
+            if site.queue_file != "":
+                site.durable_queue = DurableQueue(site.queue_file, callback, partial(is_watched_pointset, site=site))
+                callback = site.durable_queue
+            if site.record_file != "":
+                callback = MessageRecorder(site.record_file, callback)
+            callbacks[site.name] = callback
+            if site.filtered_subscription != "":
+                subscription_paths[site.name] = create_filtered_subscription(subscriber, site.project, site.subscription,
+                                                                             site.filtered_subscription, site.watched_devices)
+            else:
+                subscription_paths[site.name] = subscriber.subscription_path(site.project, site.subscription)
 
-        streaming_pull_future = subscriber.subscribe(subscription_path, callback=message_callback)
-        
-        print(f"Listening for messages from all devices on {subscription_path}\n")
+        if int(args.pull_batch) > 0:
+            def pull_site(site):
+                print(f"Pulling messages from all devices on {subscription_paths[site.name]} in batches of {args.pull_batch}\n")
+                count = pull_messages(subscriber, subscription_paths[site.name], int(args.pull_batch), TIMEOUT, site,
+                                      callbacks[site.name] if site.record_file != "" else None)
+                print("%d message(s) received for %s" % (count, site.name))
 
-        # Wrap subscriber in a 'with' block to automatically call close() when done.
-        with subscriber:
-            try:
-                # When `timeout` is not set, result() will block indefinitely,
-                # unless an exception is encountered first.
-                streaming_pull_future.result(timeout=TIMEOUT)
-            except TimeoutError:
-                streaming_pull_future.cancel()  # Trigger the shutdown.
-                streaming_pull_future.result()  # Block until the shutdown is complete.
+            with subscriber:
+                pullers = [threading.Thread(target=pull_site, args=(site,), name="pull-%s" % site.name) for site in sites.values()]
+                for puller in pullers:
+                    puller.start()
+                for puller in pullers:
+                    puller.join()
+        else:
+            streaming_pull_futures = {}
+            for site in sites.values():
+                streaming_pull_futures[site.name] = subscriber.subscribe(subscription_paths[site.name], callback=callbacks[site.name])
+                print(f"Listening for messages from all devices on {subscription_paths[site.name]}\n")
+
+            def stop_on_coverage(site):
+                site.coverage.reached.wait()
+                print("Coverage target of %s reached, stopping" % site.name)
+                streaming_pull_futures[site.name].cancel()
+
+            for site in sites.values():
+                threading.Thread(target=stop_on_coverage, args=(site,), name="coverage-watcher-%s" % site.name, daemon=True).start()
+
+            with subscriber:
+                end_time = time.time() + TIMEOUT
+                for streaming_pull_future in streaming_pull_futures.values():
+                    try:
+                        # When `timeout` is not set, result() will block indefinitely,
+                        # unless an exception is encountered first.
+                        streaming_pull_future.result(timeout=max(end_time - time.time(), 0))
+                    except TimeoutError:
+                        streaming_pull_future.cancel()  # Trigger the shutdown.
+                        streaming_pull_future.result()  # Block until the shutdown is complete.
+
+        for site in sites.values():
+            if site.record_file != "":
+                callbacks[site.name].close()
+
+        if shards > 0:
+            stop_shards(workers, merger, SHARD_DRAIN_TIMEOUT)
+        # The last cloud values received are read before the output file is written
+        if not reader_pool.wait_idle(READER_DRAIN_TIMEOUT):
+            print("%d point(s) could not be read before the end of the session" % reader_pool.pending())
+        reader_pool.stop()
+        print_stats()
+        for site in sites.values():
+            site.close()
 
         # pprint(devices_points)
 